@@ -3,144 +3,440 @@
 """
 网文改编漫剧制作汇总Excel生成脚本
 整合剧本、提示词、图像生成状态到一个Excel文档
+
+所有数据都从运行目录读取（00_info.json、02_image_prompts、03_generated_images、
+02.5_validation、trace.json），按集自动创建镜头工作表。镜头行逐行写入openpyxl的
+write-only工作簿，内存占用不随镜头数量增长。
+
+scripts/image_assets.py 生成过缩略图时（03_generated_images/thumbnails），
+镜头工作表会嵌入缩略图；只读缩略图文件，不打开全尺寸图像。嵌入图片需要Pillow。
 """
 
-import pandas as pd
 from datetime import datetime
 import json
 import os
+import re
+import sys
+
+from openpyxl import Workbook
+from openpyxl.drawing.image import Image as ExcelImage
+
+try:
+    import PIL  # noqa: F401  openpyxl读取图片尺寸需要Pillow
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+# Excel单元格最多容纳32767个字符
+MAX_CELL_CHARS = 32767
+
+PROMPT_FILE_RE = re.compile(r'^Episode-(\d+)-Prompts\.json$')
+SCENE_REF_RE = re.compile(r'【背景参考([^】]+)】')
+REPORT_STAT_RE = re.compile(r'^-\s*(\S+?)\s*[:：]\s*(\d+)\s*$')
+# 剧本标题行："# 第1集 标题"、"# 第1集：标题"、"# Episode-01：标题"
+SCRIPT_TITLE_RE = re.compile(r'^#+\s*(?:第\d+集|Episode[-_ ]?\d+)?\s*[：:]?\s*', re.IGNORECASE)
+
+SHOT_HEADER = ['镜头编号', '文件名', '缩略图', '状态', '角色', '参考图', '描述', '提示词', '修复后提示词']
+THUMB_COLUMN = 'C'
+# 缩略图在表格中的显示宽度（像素），行高按比例调整
+THUMB_WIDTH = 128
+TRACE_HEADER = ['阶段', '单元', '类型', '耗时(秒)', 'CPU(秒)', '内存峰值(MB)', '读(MB)', '写(MB)', '重试', '错误']
+# 运行耗时工作表中列出的最慢单元数
+SLOWEST_UNITS = 20
+
+RUN_STRUCTURE = [
+    ('01_scripts', '剧本文件（Episode-XX.md）'),
+    ('02_image_prompts', '图像提示词（Episode-XX-Prompts.json）'),
+    ('02.5_validation', '验证报告（validation_report.md）'),
+    ('03_generated_images', '生成的图像（PNG）'),
+    ('04_video_prompts', '视频提示词'),
+    ('05_generated_videos', '生成的视频（MP4）'),
+    ('06_final_excel', 'Excel汇总文档'),
+]
+
+
+def _load_json(path, default=None):
+    """读取JSON文件，文件不存在或格式错误时返回默认值"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _cell(text):
+    """把值转换成可写入单元格的文本"""
+    if text is None:
+        return ''
+    if isinstance(text, (list, tuple)):
+        text = '、'.join(str(item) for item in text)
+    text = str(text)
+    return text[:MAX_CELL_CHARS]
+
+
+def find_episode_prompt_files(run_dir):
+    """扫描02_image_prompts，返回按集数排序的 [(集数, 文件路径)]"""
+    prompts_dir = os.path.join(run_dir, '02_image_prompts')
+    episodes = []
+    try:
+        entries = os.scandir(prompts_dir)
+    except OSError:
+        return episodes
+    with entries:
+        for entry in entries:
+            match = PROMPT_FILE_RE.match(entry.name)
+            if match and entry.is_file():
+                episodes.append((int(match.group(1)), entry.path))
+    episodes.sort()
+    return episodes
+
+
+def load_fixed_prompts(run_dir, default_episode):
+    """读取fixed_prompts.json，返回 {(集数, 镜头编号): 修复后提示词}
+
+    早期的验证脚本只处理第一集且不记录集数，没有episode字段的条目归到default_episode。
+    """
+    data = _load_json(os.path.join(run_dir, '02.5_validation', 'fixed_prompts.json'), [])
+    fixed = {}
+    for item in data if isinstance(data, list) else []:
+        shot_number = item.get('shot_number')
+        if not shot_number:
+            continue
+        episode = item.get('episode', default_episode)
+        fixed[(int(episode), shot_number)] = item.get('prompt', '')
+    return fixed
+
+
+def load_generation_status(run_dir, episode):
+    """读取某一集的generation_status.json和目录中实际存在的PNG文件名"""
+    image_dir = os.path.join(run_dir, '03_generated_images', f'Episode-{episode:02d}')
+    status = _load_json(os.path.join(image_dir, 'generation_status.json'), {})
+    images = {}
+    for image in status.get('images', []) if isinstance(status, dict) else []:
+        if image.get('shot_number'):
+            images[image['shot_number']] = image
+
+    on_disk = set()
+    try:
+        with os.scandir(image_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.png'):
+                    on_disk.add(entry.name)
+    except OSError:
+        pass
+    return images, on_disk
+
+
+def load_thumbnails(run_dir, episode):
+    """返回某一集缩略图目录中的 {文件名(不含扩展名): 路径}"""
+    thumb_dir = os.path.join(run_dir, '03_generated_images', 'thumbnails', f'Episode-{episode:02d}')
+    thumbs = {}
+    try:
+        with os.scandir(thumb_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.jpg'):
+                    thumbs[entry.name[:-4]] = entry.path
+    except OSError:
+        pass
+    return thumbs
+
+
+def thumbnail_image(path):
+    """按显示宽度缩放的嵌入图片；图片数据在保存工作簿时才读取"""
+    image = ExcelImage(path)
+    image.height = round(image.height * THUMB_WIDTH / image.width)
+    image.width = THUMB_WIDTH
+    return image
+
+
+def load_validation_stats(run_dir):
+    """从validation_report.md的汇总统计中解析各项数量"""
+    stats = {}
+    report = os.path.join(run_dir, '02.5_validation', 'validation_report.md')
+    try:
+        with open(report, 'r', encoding='utf-8') as f:
+            in_summary = False
+            for line in f:
+                line = line.strip()
+                if line.startswith('## '):
+                    if in_summary:
+                        break
+                    in_summary = '汇总统计' in line
+                    continue
+                match = REPORT_STAT_RE.match(line) if in_summary else None
+                if match:
+                    stats[match.group(1)] = int(match.group(2))
+    except OSError:
+        pass
+    return stats
+
+
+def load_trace_rows(run_dir):
+    """读取trace.json（scripts/run_trace.py写出），返回各阶段汇总行和最慢的单元行"""
+    trace = _load_json(os.path.join(run_dir, 'trace.json'), {})
+    spans = trace.get('spans', []) if isinstance(trace, dict) else []
+
+    def row(span, unit, kind, units=0, retries=None, errors=None):
+        return [
+            span['stage'],
+            unit,
+            kind,
+            round(span['wall_s'], 3),
+            round(span['cpu_s'], 3),
+            span['peak_rss_mb'],
+            round(span['read_bytes'] / 1024 ** 2, 2),
+            round(span['write_bytes'] / 1024 ** 2, 2),
+            span['retries'] if retries is None else retries,
+            _cell(span.get('error', '')) if errors is None else errors,
+        ]
 
-def create_production_excel(run_dir, output_dir):
-    """生成制作汇总Excel"""
+    stages = {}
+    units = []
+    for span in spans:
+        if span.get('cat') == 'stage':
+            stages[span['stage']] = span
+        else:
+            units.append(span)
+    retries = {name: 0 for name in stages}
+    errors = {name: 0 for name in stages}
+    counts = {name: 0 for name in stages}
+    for span in units:
+        if span['stage'] in stages:
+            counts[span['stage']] += 1
+            retries[span['stage']] += span['retries']
+            errors[span['stage']] += 1 if span.get('error') else 0
+
+    stage_rows = [
+        row(span, f'{counts[name]}个单元', '阶段',
+            retries=span['retries'] + retries[name],
+            errors=errors[name] + (1 if span.get('error') else 0))
+        for name, span in sorted(stages.items(), key=lambda item: item[1]['start'])
+    ]
+    units.sort(key=lambda span: span['wall_s'], reverse=True)
+    unit_rows = []
+    for span in units[:SLOWEST_UNITS]:
+        episode = (span.get('args') or {}).get('episode')
+        label = f"第{episode}集 {span['name']}" if episode else span['name']
+        unit_rows.append(row(span, label, span.get('cat', '')))
+    return stage_rows, unit_rows
+
+
+def resolve_shot_file(episode, shot_number, status_entry, on_disk):
+    """找到镜头对应的图像文件名，返回 (文件名, 是否存在)"""
+    candidates = [f'Episode-{episode:02d}-{shot_number}.png']
+    if status_entry and status_entry.get('filename'):
+        candidates.append(status_entry['filename'])
+    for name in candidates:
+        if name in on_disk:
+            return name, True
+    return candidates[0], False
+
+
+def iter_shot_rows(episode, shots, images, on_disk, fixed, counters):
+    """逐行生成某一集的镜头清单，同时累计统计数据"""
+    for shot in shots:
+        shot_number = shot.get('shot_number', '')
+        status_entry = images.get(shot_number)
+        filename, exists = resolve_shot_file(episode, shot_number, status_entry, on_disk)
+
+        # 状态以磁盘上的文件为准，避免状态文件与实际不一致
+        if exists:
+            state = '已生成'
+            counters['generated'] += 1
+        elif status_entry:
+            state = '缺失文件'
+        else:
+            state = '待生成'
+
+        characters = shot.get('characters') or []
+        counters['characters'].update(dict.fromkeys(characters))
+        counters['scenes'].update(dict.fromkeys(SCENE_REF_RE.findall(shot.get('prompt') or '')))
+
+        description = status_entry.get('description', '') if status_entry else ''
+        fixed_prompt = fixed.get((episode, shot_number), '')
+        if fixed_prompt:
+            counters['fixed'] += 1
+        counters['shots'] += 1
+
+        yield [
+            shot_number,
+            filename,
+            None,
+            state,
+            _cell(characters),
+            _cell(shot.get('character_refs')),
+            _cell(description),
+            _cell(shot.get('prompt')),
+            _cell(fixed_prompt),
+        ]
+
+
+def _chapter_range(info):
+    """章节范围：新版记录在parameters.chapter_range，早期运行记录在run_info.chapters"""
+    return (info.get('parameters', {}).get('chapter_range')
+            or info.get('run_info', {}).get('chapters', ''))
+
+
+def _chapter_label(info, episode, index):
+    """根据00_info.json推断某一集对应的章节"""
+    chapters = info.get('input', {}).get('novel_chapters') or []
+    if index < len(chapters):
+        name = os.path.basename(chapters[index])
+        match = re.match(r'^(第\d+章)', name)
+        if match:
+            return match.group(1)
+    match = re.match(r'^(\d+)', _chapter_range(info))
+    start = int(match.group(1)) if match else 1
+    return f'第{start + index}章'
+
+
+def _episode_title(run_dir, info, episode):
+    """优先使用00_info.json中的标题，否则读取剧本第一行"""
+    stats = info.get('statistics', {}).get(f'episode_{episode}', {})
+    if stats.get('title'):
+        return stats['title']
+    script = os.path.join(run_dir, '01_scripts', f'Episode-{episode:02d}.md')
+    try:
+        with open(script, 'r', encoding='utf-8') as f:
+            first_line = f.readline().strip()
+    except OSError:
+        return ''
+    return SCRIPT_TITLE_RE.sub('', first_line)
+
+
+def create_production_excel(run_dir, output_dir, thumbnails=True):
+    """生成制作汇总Excel，thumbnails=False时不嵌入缩略图"""
 
     # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
 
-    # 创建Excel写入器
+    info = _load_json(os.path.join(run_dir, '00_info.json'), {})
+    parameters = info.get('parameters', {})
+    episode_files = find_episode_prompt_files(run_dir)
+    first_episode = episode_files[0][0] if episode_files else 1
+    fixed = load_fixed_prompts(run_dir, first_episode)
+
+    # write-only工作簿：行数据直接写入临时文件，不在内存中保留整个工作簿
     excel_file = os.path.join(output_dir, f"Production_Data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-    writer = pd.ExcelWriter(excel_file, engine='openpyxl')
+    wb = Workbook(write_only=True)
+
+    # 先创建概览和汇总工作表以固定顺序，数据在镜头清单写完后再填入
+    ws_overview = wb.create_sheet('项目概览')
+    ws_episodes = wb.create_sheet('分集汇总')
+
+    # ==================== 各集镜头清单 ====================
+    episode_rows = []
+    totals = {'shots': 0, 'generated': 0, 'fixed': 0}
+    for index, (episode, prompt_file) in enumerate(episode_files):
+        shots = _load_json(prompt_file, [])
+        if not isinstance(shots, list):
+            shots = []
+        images, on_disk = load_generation_status(run_dir, episode)
+        # characters/scenes用dict保持出现顺序并去重
+        counters = {'shots': 0, 'generated': 0, 'fixed': 0, 'characters': {}, 'scenes': {}}
+
+        thumbs = load_thumbnails(run_dir, episode) if thumbnails and HAS_PILLOW else {}
+
+        ws_shots = wb.create_sheet(f'第{episode}集镜头')
+        if thumbs:
+            ws_shots.column_dimensions[THUMB_COLUMN].width = THUMB_WIDTH / 7
+        ws_shots.append(SHOT_HEADER)
+        row_index = 1
+        for row in iter_shot_rows(episode, shots, images, on_disk, fixed, counters):
+            row_index += 1
+            thumb = thumbs.get(os.path.splitext(row[1])[0]) if row[3] == '已生成' else None
+            if thumb:
+                image = thumbnail_image(thumb)
+                # write-only模式下行高要在写入该行之前设置（像素→磅）
+                ws_shots.row_dimensions[row_index].height = image.height * 0.75 + 4
+                ws_shots.add_image(image, f'{THUMB_COLUMN}{row_index}')
+            ws_shots.append(row)
+        del shots, images, on_disk, thumbs
+
+        for key in totals:
+            totals[key] += counters[key]
+
+        if counters['shots'] and counters['generated'] == counters['shots']:
+            state = '完成'
+        elif counters['generated']:
+            state = '部分生成'
+        else:
+            state = '待生成'
+        episode_rows.append([
+            episode,
+            _episode_title(run_dir, info, episode),
+            _chapter_label(info, episode, index),
+            counters['shots'],
+            counters['generated'],
+            _cell(list(counters['characters'])),
+            _cell(list(counters['scenes'])),
+            state,
+        ])
 
     # ==================== 工作表1：项目概览 ====================
-    overview_data = {
-        '项目名称': ['网文改编漫剧-封神榜BUG'],
-        '运行时间': [datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
-        '处理章节': ['第1章-第3章'],
-        '生成集数': ['3集'],
-        '总镜头数': ['44镜头（第1集24 + 第2集12 + 第3集8）'],
-        '风格': ['国风动漫'],
-        '引擎': ['doubao-seedream-4-0-250828']
-    }
-    df_overview = pd.DataFrame(overview_data)
-    df_overview.to_excel(writer, sheet_name='项目概览', index=False)
+    chapter_range = _chapter_range(info)
+    per_episode = ' + '.join(f'第{row[0]}集{row[3]}' for row in episode_rows)
+    ws_overview.append(['项目名称', '运行时间', '处理章节', '生成集数', '总镜头数', '已生成图像', '风格', '引擎'])
+    ws_overview.append([
+        info.get('project_name', '网文改编漫剧-封神榜BUG'),
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        f"第{chapter_range.replace('-', '章-第')}章" if chapter_range else '',
+        f'{len(episode_rows)}集',
+        f"{totals['shots']}镜头（{per_episode}）" if per_episode else f"{totals['shots']}镜头",
+        totals['generated'],
+        parameters.get('style', ''),
+        parameters.get('engine', ''),
+    ])
 
     # ==================== 工作表2：分集汇总 ====================
-    episodes_data = []
-
-    # 第1集
-    episodes_data.append({
-        '集数': 1,
-        '标题': '穿成矿奴，金手指觉醒',
-        '章节': '第1章',
-        '镜头数': 24,
-        '核心角色': ['林渊', '青袍修士'],
-        '主要场景': ['矿洞', '现代办公室', '系统界面'],
-        '状态': '完成'
-    })
-
-    # 第2集
-    episodes_data.append({
-        '集数': 2,
-        '标题': '修士死了，封神榜却没动',
-        '章节': '第2章',
-        '镜头数': 12,
-        '核心角色': ['林渊', '修士'],
-        '主要场景': ['矿洞废墟', '封神榜虚空', '系统界面'],
-        '状态': '完成'
-    })
-
-    # 第3集
-    episodes_data.append({
-        '集数': 3,
-        '标题': '该上榜的人，还没死',
-        '章节': '第3章',
-        '镜头数': 8,
-        '核心角色': ['林渊'],
-        '主要场景': ['偏房', '虚空', '命数轨迹'],
-        '状态': '完成'
-    })
-
-    df_episodes = pd.DataFrame(episodes_data)
-    df_episodes.to_excel(writer, sheet_name='分集汇总', index=False)
-
-    # ==================== 工作表3：第1集镜头清单 ====================
-    episode1_shots = []
-    for i in range(1, 25):
-        shot_num = f"shot_{i:03d}"
-        episode1_shots.append({
-            '镜头编号': shot_num,
-            '文件名': f"Episode-01-{shot_num}.png",
-            '状态': '已生成',
-            '描述': f'第1集镜头{i}'
-        })
-
-    df_ep1 = pd.DataFrame(episode1_shots)
-    df_ep1.to_excel(writer, sheet_name='第1集镜头', index=False)
-
-    # ==================== 工作表4：第2集镜头清单 ====================
-    episode2_shots = []
-    for i in range(1, 13):
-        shot_num = f"shot_{i:03d}"
-        episode2_shots.append({
-            '镜头编号': shot_num,
-            '文件名': f"Episode-02-{shot_num}.png",
-            '状态': '已生成',
-            '描述': f'第2集镜头{i}'
-        })
-
-    df_ep2 = pd.DataFrame(episode2_shots)
-    df_ep2.to_excel(writer, sheet_name='第2集镜头', index=False)
-
-    # ==================== 工作表5：第3集镜头清单 ====================
-    episode3_shots = []
-    for i in range(1, 9):
-        shot_num = f"shot_{i:03d}"
-        episode3_shots.append({
-            '镜头编号': shot_num,
-            '文件名': f"Episode-03-{shot_num}.png",
-            '状态': '已生成',
-            '描述': f'第3集镜头{i}'
-        })
-
-    df_ep3 = pd.DataFrame(episode3_shots)
-    df_ep3.to_excel(writer, sheet_name='第3集镜头', index=False)
-
-    # ==================== 工作表6：提示词验证汇总 ====================
-    validation_data = {
-        '验证项': ['总镜头数', '验证通过', '需要修复', '可自动修复', '需要人工处理'],
-        '数量': [44, 0, 44, 44, 0],
-        '说明': ['所有提示词都经过验证和自动修复', '', '质量约束已补充', '使用prompt_validator.py', '无需要人工处理的问题']
-    }
-    df_validation = pd.DataFrame(validation_data)
-    df_validation.to_excel(writer, sheet_name='提示词验证', index=False)
-
-    # ==================== 工作表7：文件目录结构 ====================
-    structure_data = {
-        '目录': ['01_scripts', '02_image_prompts', '02.5_validation', '03_generated_images', '04_video_prompts', '05_generated_videos', '06_final_excel'],
-        '说明': ['剧本文件（Episode-XX.md）', '图像提示词（Episode-XX-Prompts.json）', '验证报告（validation_report.md）', '生成的图像（PNG）', '视频提示词', '生成的视频（MP4）', 'Excel汇总文档'],
-        '状态': ['已完成', '已完成', '已完成', '已完成', '待生成', '待生成', '进行中']
-    }
-    df_structure = pd.DataFrame(structure_data)
-    df_structure.to_excel(writer, sheet_name='文件结构', index=False)
+    ws_episodes.append(['集数', '标题', '章节', '镜头数', '已生成', '核心角色', '主要场景', '状态'])
+    for row in episode_rows:
+        ws_episodes.append(row)
+
+    # ==================== 提示词验证汇总 ====================
+    stats = load_validation_stats(run_dir)
+    ws_validation = wb.create_sheet('提示词验证')
+    ws_validation.append(['验证项', '数量', '说明'])
+    ws_validation.append(['总镜头数', totals['shots'], f"验证报告覆盖{stats.get('总镜头数', 0)}个镜头"])
+    for key in ('验证通过', '需要修复', '可自动修复', '需要人工处理'):
+        ws_validation.append([key, stats.get(key, 0), ''])
+    ws_validation.append(['已写入修复提示词', totals['fixed'], 'fixed_prompts.json'])
+
+    # ==================== 运行耗时 ====================
+    stage_rows, unit_rows = load_trace_rows(run_dir)
+    ws_trace = wb.create_sheet('运行耗时')
+    ws_trace.append(TRACE_HEADER)
+    if not stage_rows:
+        ws_trace.append(['未找到trace.json，请用 scripts/run_trace.py 记录各阶段'])
+    for row in stage_rows:
+        ws_trace.append(row)
+    if unit_rows:
+        ws_trace.append([])
+        ws_trace.append([f'最慢的{len(unit_rows)}个单元'])
+        for row in unit_rows:
+            ws_trace.append(row)
+
+    # ==================== 文件目录结构 ====================
+    ws_structure = wb.create_sheet('文件结构')
+    ws_structure.append(['目录', '说明', '状态'])
+    for dirname, description in RUN_STRUCTURE:
+        path = os.path.join(run_dir, dirname)
+        has_files = False
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                has_files = any(True for _ in entries)
+        ws_structure.append([dirname, description, '已完成' if has_files else '待生成'])
 
     # 保存Excel文件
-    writer.close()
+    wb.save(excel_file)
 
     print(f"✅ Excel汇总文档已生成：{excel_file}")
     return excel_file
 
+
 if __name__ == "__main__":
-    run_dir = "outputs/run_20251223_233308_anime"
-    output_dir = "outputs/run_20251223_233308_anime/06_final_excel"
+    run_dir = sys.argv[1] if len(sys.argv) > 1 else "outputs/run_20251223_233308_anime"
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(run_dir, "06_final_excel")
 
     excel_file = create_production_excel(run_dir, output_dir)
     print(f"\n📊 制作数据汇总完成！")
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fullflow产物处理的基准测试
+
+按指定规模生成合成运行目录（N章 × 每集M个镜头）：
+    novel/              合成章节
+    00_info.json        参数与章节列表
+    01_scripts/         合成剧本
+    02_image_prompts/   提示词取自真实运行的提示词，打乱句子顺序，长度分布与真实数据一致
+    03_generated_images/ 小尺寸占位PNG（按比例留出待生成镜头）+ generation_status.json
+然后对下列处理路径计时，每项在独立的子进程中运行，单独统计峰值内存：
+    excel              production_summary.create_production_excel
+    validation_cold    PromptValidator.validate_run（无缓存）
+    validation_warm    PromptValidator.validate_run（缓存命中，缓存在同一子进程里先不计时地建好）
+    status             按磁盘文件校正各集 generation_status（EpisodeStatus）
+    scan               run_cache.iter_run_artifacts 计算全部产物的缓存键
+
+每项启动 --repeat 个子进程（默认7），每个子进程里反复执行被测路径至少0.25秒，
+取最快的一次；噪声只会让耗时变长，用所有子进程中的最小值作比较，并记录
+各子进程结果的相对标准差(spread)。
+结果与基准文件（默认 scripts/benchmark_baseline.json）对比，耗时增加超过
+容差时返回非零退出码。容差取 --tolerance 与 本次/基准中较大spread的3倍
+两者的较大值，但最多放宽到 --tolerance 的2倍，明显的退化不会被噪声掩盖；
+超出容差的测试项会再测一轮，两轮都超出才算退化。
+--save-baseline 把本次结果写为新的基准。
+基准只在相同规模下可比，不同机器上的绝对数值也不可直接比较。
+
+用法：
+    python scripts/benchmark.py run --chapters 40 --shots 60
+    python scripts/benchmark.py run --only excel,validation_cold --repeat 11
+    python scripts/benchmark.py run --save-baseline
+    python scripts/benchmark.py generate /tmp/run_synthetic --chapters 3 --shots 20
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from image_scheduler import EpisodeStatus, _png_bytes, shot_filename
+from prompt_validator import CACHE_FILE, VALIDATION_DIR, PromptValidator
+from run_cache import atomic_write_json, iter_run_artifacts
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SCRIPTS_DIR)
+SAMPLE_RUN = os.path.join(REPO_DIR, 'outputs', 'run_20251223_233308_anime')
+EXCEL_SCRIPT = os.path.join(SAMPLE_RUN, '06_final_excel', 'production_summary.py')
+DEFAULT_BASELINE = os.path.join(SCRIPTS_DIR, 'benchmark_baseline.json')
+DEFAULT_REFS_DIR = os.path.join(REPO_DIR, 'references')
+
+BENCHMARKS = ('excel', 'validation_cold', 'validation_warm', 'status', 'scan')
+DEFAULT_REPEAT = 7
+# 每个子进程里被测路径至少累计执行这么久（秒），几十毫秒的测试项会执行多次
+MIN_SAMPLE_SECONDS = 0.25
+# 容差至少为测得的相对标准差的这么多倍，但最多放宽到 --tolerance 的 MAX_WIDENING 倍
+SPREAD_FACTOR = 3
+MAX_WIDENING = 2
+
+# 找不到真实提示词时使用的句子素材
+FALLBACK_FRAGMENTS = (
+    '【背景参考矿洞】陈塘关矿场地下深处', '幽暗矿洞的巨大空间中', '地面刻着复杂阵法纹路',
+    '远景矿洞顶部倒悬的钟乳石密布', '中景地面巨大阵法直径约十米', '血红色纹路在地面交织成复杂图案',
+    '阴沉暗光环境', '火把的暖黄色光与血红色光形成对比', '电影级远景镜头', '画幅比例16:9',
+    '仙侠动漫风格', '色彩鲜明对比强烈', '流畅线条', '中国玄幻国风动漫风格',
+    '光影统一符合场景氛围', '画面干净不要文字水印logo', '不要畸形手指和多余肢体',
+)
+
+
+def load_sample_shots(sample_run=SAMPLE_RUN):
+    """读取真实运行的全部镜头，作为合成提示词的素材"""
+    prompts_dir = os.path.join(sample_run, '02_image_prompts')
+    shots = []
+    try:
+        names = sorted(os.listdir(prompts_dir))
+    except OSError:
+        names = []
+    for name in names:
+        if name.endswith('-Prompts.json'):
+            with open(os.path.join(prompts_dir, name), 'r', encoding='utf-8') as f:
+                shots.extend(shot for shot in json.load(f) if shot.get('prompt'))
+    if not shots:
+        shots = [{'prompt': '，'.join(FALLBACK_FRAGMENTS) + '。', 'has_character': False,
+                  'characters': [], 'character_refs': []}]
+    return shots
+
+
+def synthetic_prompt(sample, rng):
+    """保留首尾句（参考图标记和风格约束），打乱中间的句子"""
+    parts = sample['prompt'].rstrip('。').split('，')
+    middle = parts[1:-1]
+    rng.shuffle(middle)
+    return '，'.join(parts[:1] + middle + parts[-1:]) + '。'
+
+
+def generate_run(run_dir, chapters=40, shots=60, generated_ratio=0.9,
+                 image_size=(64, 36), seed=0, sample_run=SAMPLE_RUN):
+    """生成合成运行目录，返回总镜头数"""
+    rng = random.Random(seed)
+    samples = load_sample_shots(sample_run)
+    novel_dir = os.path.join(run_dir, 'novel')
+    for dirname in ('01_scripts', '02_image_prompts', '03_generated_images'):
+        os.makedirs(os.path.join(run_dir, dirname), exist_ok=True)
+    os.makedirs(novel_dir, exist_ok=True)
+
+    chapter_files = []
+    for chapter in range(1, chapters + 1):
+        path = os.path.join(novel_dir, f'第{chapter}章-合成章节{chapter}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            for _ in range(60):
+                f.write(f'{synthetic_prompt(rng.choice(samples), rng)}\n\n')
+        chapter_files.append(path)
+
+    png = _png_bytes(*image_size, seed=seed)
+    total = 0
+    for episode in range(1, chapters + 1):
+        with open(os.path.join(run_dir, '01_scripts', f'Episode-{episode:02d}.md'), 'w',
+                  encoding='utf-8') as f:
+            f.write(f'# 第{episode}集 合成剧本{episode}\n\n')
+            for scene in range(20):
+                f.write(f'## 场景{scene + 1}\n{synthetic_prompt(rng.choice(samples), rng)}\n\n')
+
+        episode_shots = []
+        for index in range(1, shots + 1):
+            sample = rng.choice(samples)
+            episode_shots.append({
+                'shot_number': f'shot_{index:03d}',
+                'prompt': synthetic_prompt(sample, rng),
+                'has_character': sample.get('has_character', False),
+                'characters': list(sample.get('characters') or []),
+                'character_refs': list(sample.get('character_refs') or []),
+            })
+        atomic_write_json(os.path.join(run_dir, '02_image_prompts', f'Episode-{episode:02d}-Prompts.json'),
+                          episode_shots)
+
+        image_dir = os.path.join(run_dir, '03_generated_images', f'Episode-{episode:02d}')
+        os.makedirs(image_dir, exist_ok=True)
+        for shot in episode_shots:
+            if rng.random() < generated_ratio:
+                with open(os.path.join(image_dir, shot_filename(episode, shot['shot_number'])), 'wb') as f:
+                    f.write(png)
+        EpisodeStatus(run_dir, episode, episode_shots, engine='synthetic', style='国风动漫').save()
+        total += len(episode_shots)
+
+    atomic_write_json(os.path.join(run_dir, '00_info.json'), {
+        'run_id': os.path.basename(os.path.normpath(run_dir)),
+        'command': 'benchmark',
+        'parameters': {'chapter_range': f'1-{chapters}', 'style': '国风动漫', 'engine': 'synthetic'},
+        'input': {'novel_chapters': chapter_files, 'total_chapters': chapters},
+        'output': {'episodes_generated': chapters, 'total_shots': total},
+    })
+    return total
+
+
+def _load_excel_module():
+    spec = importlib.util.spec_from_file_location('production_summary', EXCEL_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _bench_excel(run_dir):
+    module = _load_excel_module()
+    out_dir = tempfile.mkdtemp(prefix='bench-excel-')
+    try:
+        start = time.perf_counter()
+        module.create_production_excel(run_dir, out_dir)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def _bench_validation(run_dir, warm):
+    # 不依赖之前运行过的测试项留下的缓存：每次从无缓存开始，warm先建好缓存
+    cache_path = os.path.join(run_dir, VALIDATION_DIR, CACHE_FILE)
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    validator = PromptValidator(DEFAULT_REFS_DIR)
+    if warm:
+        validator.validate_run(run_dir)
+        validator = PromptValidator(DEFAULT_REFS_DIR)
+    start = time.perf_counter()
+    validator.validate_run(run_dir)
+    return time.perf_counter() - start
+
+
+def _bench_status(run_dir):
+    start = time.perf_counter()
+    generated = 0
+    prompts_dir = os.path.join(run_dir, '02_image_prompts')
+    for name in sorted(os.listdir(prompts_dir)):
+        episode = int(name.split('-')[1])
+        with open(os.path.join(prompts_dir, name), 'r', encoding='utf-8') as f:
+            shots = [shot for shot in json.load(f) if shot.get('shot_number')]
+        generated += EpisodeStatus(run_dir, episode, shots).data['generated']
+    return time.perf_counter() - start
+
+
+def _bench_scan(run_dir):
+    with open(os.path.join(run_dir, '00_info.json'), 'r', encoding='utf-8') as f:
+        chapter_files = json.load(f)['input']['novel_chapters']
+    start = time.perf_counter()
+    for _ in iter_run_artifacts(run_dir, chapter_files):
+        pass
+    return time.perf_counter() - start
+
+
+def run_benchmark(name, run_dir, min_seconds=MIN_SAMPLE_SECONDS):
+    """在子进程中执行一项基准测试，返回 (最快一次的耗时秒数, 峰值内存MB)"""
+    # 被测函数会打印进度信息，子进程里直接丢弃
+    sys.stdout = open(os.devnull, 'w')
+    bench = {
+        'excel': partial(_bench_excel, run_dir),
+        'validation_cold': partial(_bench_validation, run_dir, warm=False),
+        'validation_warm': partial(_bench_validation, run_dir, warm=True),
+        'status': partial(_bench_status, run_dir),
+        'scan': partial(_bench_scan, run_dir),
+    }[name]
+    timings = []
+    while not timings or sum(timings) < min_seconds:
+        timings.append(bench())
+    seconds = min(timings)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return seconds, peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_suite(run_dir, total_shots, names=BENCHMARKS, repeat=DEFAULT_REPEAT):
+    """每项测试启动repeat个子进程，取最快的一次和各子进程结果的相对标准差"""
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        timings = []
+        peak = 0.0
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                seconds, rss = pool.submit(run_benchmark, name, run_dir).result()
+            timings.append(seconds)
+            peak = max(peak, rss)
+        best = min(timings)
+        median = statistics.median(timings)
+        spread = statistics.stdev(timings) / median if len(timings) > 1 and median else 0.0
+        results[name] = {
+            'seconds': round(best, 4),
+            'median_seconds': round(median, 4),
+            'spread': round(spread, 3),
+            'shots_per_s': round(total_shots / best, 1) if best else None,
+            'peak_rss_mb': round(peak, 1),
+        }
+    return results
+
+
+def _check(result, base, tolerance):
+    """返回 (相对基准的变化, 容差)
+
+    容差至少为 SPREAD_FACTOR 倍的相对标准差（本次与基准取大），避免把测量噪声
+    当成退化；但不超过 MAX_WIDENING 倍的tolerance。
+    """
+    change = (result['seconds'] - base['seconds']) / base['seconds'] if base['seconds'] else 0.0
+    noise = SPREAD_FACTOR * max(result['spread'], base.get('spread', 0.0))
+    return change, min(max(tolerance, noise), MAX_WIDENING * tolerance)
+
+
+def find_regressions(results, baseline, tolerance):
+    """超出容差的测试项名称"""
+    names = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base:
+            change, allowed = _check(result, base, tolerance)
+            if change > allowed:
+                names.append(name)
+    return names
+
+
+def compare(results, baseline, tolerance):
+    """打印与基准的对比，返回退化的测试数"""
+    regressions = 0
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        line = (f"  {name:<16} {result['seconds']:>9.3f}s ±{result['spread']:>4.0%}  "
+                f"{result['shots_per_s'] or 0:>10.1f} 镜头/s  "
+                f"内存峰值 {result['peak_rss_mb']:>7.1f}MB")
+        if not base:
+            print(line)
+            continue
+        change, allowed = _check(result, base, tolerance)
+        regressed = change > allowed
+        regressions += regressed
+        print(f"{line}  基准 {base['seconds']:.3f}s ({change:+.0%}，容差{allowed:.0%})"
+              f"{'  ❌ 退化' if regressed else ''}")
+    return regressions
+
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='fullflow产物处理的基准测试')
+    parser.add_argument('action', choices=['run', 'generate'])
+    parser.add_argument('run_dir', nargs='?', help='generate的输出目录；run时默认使用临时目录')
+    parser.add_argument('--chapters', type=int, default=40)
+    parser.add_argument('--shots', type=int, default=60, help='每集镜头数')
+    parser.add_argument('--generated-ratio', type=float, default=0.9, help='已生成图像的镜头比例')
+    parser.add_argument('--image-size', type=_parse_size, default=(64, 36), help='占位PNG尺寸，如 64x36')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', help=f"逗号分隔，可选：{','.join(BENCHMARKS)}")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='每项启动的子进程数，取最快的一次')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='耗时增加超过该比例视为退化（测得的波动更大时自动放宽，最多到2倍）')
+    args = parser.parse_args(argv)
+
+    if args.action == 'generate':
+        if not args.run_dir:
+            parser.error('generate需要指定输出目录')
+        total = generate_run(args.run_dir, args.chapters, args.shots, args.generated_ratio,
+                             args.image_size, args.seed)
+        print(f"✅ 已生成合成运行目录：{args.run_dir}（{args.chapters}集，{total}个镜头）")
+        return 0
+
+    names = args.only.split(',') if args.only else BENCHMARKS
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的测试项：{','.join(unknown)}")
+
+    scale = {
+        'chapters': args.chapters,
+        'shots_per_episode': args.shots,
+        'generated_ratio': args.generated_ratio,
+        'image_size': list(args.image_size),
+        'seed': args.seed,
+    }
+    baseline = {}
+    try:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if baseline and baseline.get('scale') != scale:
+        print(f"⚠️ 基准文件的规模与本次不同，不做对比：{baseline.get('scale')}")
+        baseline = {}
+
+    run_dir = args.run_dir or tempfile.mkdtemp(prefix='run_benchmark_')
+    try:
+        start = time.perf_counter()
+        total = generate_run(run_dir, args.chapters, args.shots, args.generated_ratio,
+                             args.image_size, args.seed)
+        print(f"📊 合成运行：{args.chapters}集 × {args.shots}镜头 = {total}个镜头"
+              f"（生成用时 {time.perf_counter() - start:.1f}s）")
+        results = run_suite(run_dir, total, names, args.repeat)
+        # 共享机器上偶尔整段时间变慢：超出容差的测试项再测一轮，取两轮中较快的结果，
+        # 真实的退化两轮都会超出
+        suspects = [] if args.save_baseline else find_regressions(results, baseline, args.tolerance)
+        if suspects:
+            print(f"🔁 复测超出容差的测试项：{','.join(suspects)}")
+            for name, result in run_suite(run_dir, total, suspects, args.repeat).items():
+                if result['seconds'] < results[name]['seconds']:
+                    results[name] = result
+    finally:
+        if not args.run_dir:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        atomic_write_json(args.baseline, {
+            'version': 1,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'machine': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'scale': scale,
+            'results': results,
+        })
+        print(f"✅ 基准已保存：{args.baseline}")
+        return 0
+    if regressions:
+        print(f"❌ {regressions}项测试比基准慢，超出容差")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+角色一致性检测
+
+为运行目录中每张 Episode-XX-shot_NNN.png 计算64位差值哈希(dHash)
+和8x8 RGB缩略图向量，缓存在 03_generated_images/.features/ 下：
+    index.json     文件名、大小、修改时间
+    dhash.npy      uint64 (N,)
+    embed.npy      float16 (N, 192)
+文件没有变化的图像不会重新解码。然后按角色（经 character_registry 归一到
+标准名）汇总出现该角色的镜头，用NumPy一次算出每个镜头到该角色中心向量的
+余弦距离，以及到多数表决dHash的汉明距离。
+
+整张图的特征混入了背景、构图和光照，不能直接当作角色外观的度量：实际运行中
+同一角色镜头之间的距离在0.18~0.93之间，没有可用的固定阈值。因此只在每个角色
+自己的距离分布里找离群值（修正z分数 = 0.6745·(d-中位数)/MAD，超过3.5），
+作为需要人工复查的镜头写入 00_info.json 的 quality_metrics.character_review。
+这些特征给不出可信的一致性百分比，quality_metrics.character_consistency
+标记为"未测量"，不保留手填的数值。
+
+依赖：numpy、Pillow
+
+用法：
+    python scripts/character_consistency.py outputs/run_xxx
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from character_registry import DEFAULT_REFS_DIR, CharacterRegistry
+from image_scheduler import IMAGES_DIR, PROMPTS_DIR, find_episodes, shot_filename
+from run_cache import atomic_write_json
+
+FEATURES_DIR = '.features'
+
+EMBED_SIZE = 8
+# 修正z分数超过该值的镜头需要复查（Iglewicz-Hoaglin建议值）
+OUTLIER_Z = 3.5
+# 镜头太少时中位数和MAD没有意义，不做判断
+MIN_SHOTS = 5
+# MAD的下限：特征按float16存储，几乎相同的图像之间也有约1e-3的距离差，
+# MAD接近0时这点误差不能算作离群
+MIN_MAD = 0.01
+UNMEASURED = '未测量'
+
+
+def image_features(path):
+    """计算一张图的dHash和8x8 RGB缩略图向量"""
+    with Image.open(path) as img:
+        img.draft('RGB', (64, 64))
+        gray = np.asarray(img.convert('L').resize((9, 8), Image.BILINEAR), dtype=np.int16)
+        small = np.asarray(img.convert('RGB').resize((EMBED_SIZE, EMBED_SIZE), Image.BILINEAR),
+                           dtype=np.float32)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    dhash = int(np.packbits(bits).view('>u8')[0])
+    vector = small.flatten() / 255.0
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return dhash, (vector / norm if norm else vector)
+
+
+class FeatureStore:
+    """图像特征的磁盘缓存，按文件大小和修改时间增量更新"""
+
+    def __init__(self, image_root):
+        self.image_root = image_root
+        self.dir = os.path.join(image_root, FEATURES_DIR)
+        self.files = []
+        self.dhash = np.zeros(0, dtype=np.uint64)
+        self.embed = np.zeros((0, EMBED_SIZE * EMBED_SIZE * 3), dtype=np.float16)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.dir, 'index.json'), 'r', encoding='utf-8') as f:
+                files = json.load(f)
+            dhash = np.load(os.path.join(self.dir, 'dhash.npy'))
+            embed = np.load(os.path.join(self.dir, 'embed.npy'))
+        except (OSError, ValueError):
+            return
+        if len(files) == len(dhash) == len(embed):
+            self.files, self.dhash, self.embed = files, dhash, embed
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        np.save(os.path.join(self.dir, 'dhash.npy'), self.dhash)
+        np.save(os.path.join(self.dir, 'embed.npy'), self.embed)
+        atomic_write_json(os.path.join(self.dir, 'index.json'), self.files, indent=None)
+
+    def update(self, rel_paths, workers=None):
+        """确保rel_paths（相对image_root）都有特征，返回它们在数组中的行号"""
+        known = {entry[0]: (i, entry) for i, entry in enumerate(self.files)}
+        rows = {}
+        todo = []
+        for rel in rel_paths:
+            stat = os.stat(os.path.join(self.image_root, rel))
+            cached = known.get(rel)
+            if cached and cached[1][1] == stat.st_size and cached[1][2] == stat.st_mtime_ns:
+                rows[rel] = cached[0]
+            else:
+                todo.append((rel, stat.st_size, stat.st_mtime_ns))
+
+        if todo:
+            paths = [os.path.join(self.image_root, rel) for rel, _, _ in todo]
+            if len(paths) > 16:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    features = list(pool.map(image_features, paths, chunksize=8))
+            else:
+                features = [image_features(path) for path in paths]
+
+            # 变化的文件覆盖原来的行，新文件追加到末尾
+            dhash = list(self.dhash)
+            embed = list(self.embed)
+            for (rel, size, mtime), (h, vector) in zip(todo, features):
+                if rel in known:
+                    row = known[rel][0]
+                    self.files[row] = [rel, size, mtime]
+                    dhash[row] = h
+                    embed[row] = vector
+                else:
+                    row = len(self.files)
+                    self.files.append([rel, size, mtime])
+                    dhash.append(h)
+                    embed.append(vector)
+                rows[rel] = row
+            self.dhash = np.array(dhash, dtype=np.uint64)
+            self.embed = np.array(embed, dtype=np.float16).reshape(len(self.files), -1)
+            self.save()
+        return [rows[rel] for rel in rel_paths]
+
+
+def hamming_to_majority(hashes):
+    """每个dHash到多数表决哈希的汉明距离 (N,)，代替O(N²)的两两比较"""
+    bits = np.unpackbits(hashes.astype('>u8').view(np.uint8).reshape(len(hashes), 8), axis=1)
+    majority = bits.mean(axis=0) >= 0.5
+    return (bits != majority).sum(axis=1)
+
+
+def centroid_distance(embed):
+    """每个镜头到中心向量的余弦距离 (N,)"""
+    vectors = embed.astype(np.float32)
+    centroid = vectors.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    if not norm:
+        return np.zeros(len(vectors))
+    return np.maximum(0.0, 1.0 - vectors @ (centroid / norm))
+
+
+def outliers(distance, z=OUTLIER_Z):
+    """按修正z分数找出距离分布中偏大的离群值"""
+    if len(distance) < MIN_SHOTS:
+        return np.zeros(len(distance), dtype=bool)
+    median = np.median(distance)
+    mad = max(float(np.median(np.abs(distance - median))), MIN_MAD)
+    return 0.6745 * (distance - median) / mad > z
+
+
+def review_characters(run_dir, registry, z=OUTLIER_Z, workers=None):
+    """统计每个角色镜头的距离分布，返回各角色明细和需要复查的镜头"""
+    image_root = os.path.join(run_dir, IMAGES_DIR)
+    shots_by_character = {}
+    for episode in find_episodes(run_dir):
+        path = os.path.join(run_dir, PROMPTS_DIR, f'Episode-{episode:02d}-Prompts.json')
+        with open(path, 'r', encoding='utf-8') as f:
+            shots = json.load(f)
+        for shot in shots:
+            if not shot.get('shot_number'):
+                continue
+            rel = os.path.join(f'Episode-{episode:02d}', shot_filename(episode, shot['shot_number']))
+            if not os.path.exists(os.path.join(image_root, rel)):
+                continue
+            for character in shot.get('characters') or []:
+                shots_by_character.setdefault(registry.canonical(character), []).append(rel)
+
+    store = FeatureStore(image_root)
+    all_paths = sorted({rel for rels in shots_by_character.values() for rel in rels})
+    rows = dict(zip(all_paths, store.update(all_paths, workers)))
+
+    details = {}
+    for character, rels in sorted(shots_by_character.items()):
+        index = np.array([rows[rel] for rel in rels])
+        distance = centroid_distance(store.embed[index])
+        hamming = hamming_to_majority(store.dhash[index])
+        flagged = outliers(distance, z)
+        details[character] = {
+            'shots': len(rels),
+            'median_distance': round(float(np.median(distance)), 4),
+            'mean_dhash_distance': round(float(hamming.mean()), 2),
+            'review': [
+                {'image': rel, 'distance': round(float(d), 4)}
+                for rel, d, flag in zip(rels, distance, flagged) if flag
+            ],
+        }
+    return details
+
+
+def write_review(run_dir, details):
+    """把需要复查的镜头写入00_info.json，并把手填的角色一致性标记为未测量"""
+    info_path = os.path.join(run_dir, '00_info.json')
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return False
+    metrics = info.setdefault('quality_metrics', {})
+    metrics['character_consistency'] = UNMEASURED
+    metrics['character_review'] = details
+    atomic_write_json(info_path, info)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='角色一致性检测')
+    parser.add_argument('run_dir')
+    parser.add_argument('--refs-dir', default=DEFAULT_REFS_DIR)
+    parser.add_argument('--z', type=float, default=OUTLIER_Z, help='离群判定的修正z分数')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+
+    registry = CharacterRegistry(args.refs_dir)
+    details = review_characters(args.run_dir, registry, args.z, args.workers)
+    if not details:
+        print('⚠️ 没有找到包含角色的已生成图像')
+        return 1
+    flagged = 0
+    for character, detail in details.items():
+        print(f"{character}: {detail['shots']}个镜头，距离中位数 {detail['median_distance']:.2f}，"
+              f"需复查 {len(detail['review'])} 个")
+        for item in detail['review']:
+            print(f"  - {item['image']}（距离 {item['distance']:.2f}）")
+        flagged += len(detail['review'])
+    write_review(args.run_dir, details)
+    print(f"✅ 角色检测完成：{flagged} 个镜头需要人工复查")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
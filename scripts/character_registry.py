@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+角色/场景参考图注册表
+
+references/registry.json 登记标准角色名、场景名及其别名（设计文档角色锁定表
+里的"林玄"、"linxuan.png" 等都映射到小说中的"林渊"），参考图默认为
+references/<标准名>.png，也可以用 image 字段指定。
+
+用法：
+    python scripts/character_registry.py linxuan.png 慧觉 矿场
+"""
+
+import argparse
+import json
+import os
+import sys
+
+DEFAULT_REFS_DIR = 'references'
+REGISTRY_FILE = 'registry.json'
+
+
+class CharacterRegistry:
+    """标准角色/场景名、别名与参考图的对应关系"""
+
+    def __init__(self, refs_dir=DEFAULT_REFS_DIR):
+        self.refs_dir = refs_dir
+        self.entries = {}
+        self.aliases = {}
+        try:
+            with open(os.path.join(refs_dir, REGISTRY_FILE), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        for kind in ('characters', 'scenes'):
+            for name, entry in data.get(kind, {}).items():
+                self.entries[name] = {
+                    'kind': kind,
+                    'image': entry.get('image', f'{name}.png'),
+                }
+                for alias in [name] + entry.get('aliases', []):
+                    self.aliases[alias.lower()] = name
+
+    def canonical(self, name):
+        """返回标准名，不认识的名字原样返回"""
+        stem = os.path.splitext(name)[0] if name.lower().endswith('.png') else name
+        return self.aliases.get(stem.lower(), stem)
+
+    def reference_image(self, name):
+        """返回参考图文件名（相对refs_dir），未登记时按 <名字>.png 处理"""
+        canonical = self.canonical(name)
+        entry = self.entries.get(canonical)
+        return entry['image'] if entry else f'{canonical}.png'
+
+    def alias_map(self, existing):
+        """别名文件名 → 已存在的参考图文件名，供验证脚本自动替换写错的参考图"""
+        mapping = {}
+        for alias, name in self.aliases.items():
+            image = self.entries[name]['image']
+            if image in existing:
+                mapping[f'{alias}.png'] = image
+        return mapping
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='角色/场景参考图注册表')
+    parser.add_argument('names', nargs='+')
+    parser.add_argument('--refs-dir', default=DEFAULT_REFS_DIR)
+    args = parser.parse_args(argv)
+
+    registry = CharacterRegistry(args.refs_dir)
+    for name in args.names:
+        image = os.path.join(args.refs_dir, registry.reference_image(name))
+        state = '✅' if os.path.exists(image) else '❌ 缺少参考图'
+        print(f"{name} → {registry.canonical(name)}  {image} {state}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
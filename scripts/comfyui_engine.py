@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地ComfyUI批量提交引擎
+
+comfyui-workflows/ 下的工作流是固定的API图（seed 42、768x768、固定提示词）。
+本脚本按 Episode-XX-Prompts.json 为每个镜头套用工作流模板：
+- 填入提示词、种子、分辨率（默认16:9）、参考图、输出文件名前缀
+- 按加载器配置（CLIPLoader / VAELoader / UNETLoader / LoRA）分组，同组镜头
+  连续排队，ComfyUI 不需要在镜头之间重新加载模型
+- 所有HTTP请求复用同一个keep-alive连接，进度通过websocket推送，不轮询
+
+有参考图的镜头使用 --edit-workflow（如 qwen-edit.json），没有参考图的镜头
+使用 --workflow（如 image_z_image_turbo.json）。
+
+依赖：websocket-client（pip install websocket-client）
+
+用法：
+    python scripts/comfyui_engine.py outputs/run_xxx --host 127.0.0.1:8188 \\
+        --workflow image_z_image_turbo_with_negative.json \\
+        --edit-workflow qwen-edit.json --refs-dir references/
+"""
+
+import argparse
+import copy
+import http.client
+import json
+import os
+import re
+import sys
+import urllib.parse
+import uuid
+
+import websocket
+
+from image_scheduler import EpisodeStatus, find_episodes, shot_filename, write_image
+from run_cache import file_hash, text_hash
+from run_trace import RunTracer
+
+WORKFLOWS_DIR = 'comfyui-workflows'
+PROMPTS_DIR = '02_image_prompts'
+
+DEFAULT_WIDTH = 1280
+DEFAULT_HEIGHT = 720
+
+LOADER_TYPES = {
+    'CheckpointLoaderSimple', 'CLIPLoader', 'VAELoader', 'UNETLoader',
+    'LoraLoader', 'LoraLoaderModelOnly',
+}
+LATENT_TYPES = {'EmptyLatentImage', 'EmptySD3LatentImage', 'WanImageToVideo'}
+EMPTY_LATENT_TYPES = {'EmptyLatentImage', 'EmptySD3LatentImage'}
+SAMPLER_TYPES = {'KSampler', 'KSamplerAdvanced'}
+TEXT_INPUTS = ('text', 'prompt')
+SEED_INPUTS = ('seed', 'noise_seed')
+OUTPUT_TYPES = {'SaveImage', 'SaveVideo'}
+
+
+def _is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+
+
+def _node_sort_key(node_id):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', node_id)]
+
+
+def load_workflow(name, workflows_dir=WORKFLOWS_DIR):
+    """读取API格式的工作流"""
+    path = name if os.path.exists(name) else os.path.join(workflows_dir, name)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def loader_signature(graph):
+    """工作流的模型加载配置，相同签名的工作流可以复用已加载的模型"""
+    loaders = []
+    for node in graph.values():
+        if node.get('class_type') in LOADER_TYPES:
+            literal = {k: v for k, v in node['inputs'].items() if not _is_link(v)}
+            loaders.append((node['class_type'], json.dumps(literal, sort_keys=True, ensure_ascii=False)))
+    return tuple(sorted(loaders))
+
+
+def _find_text_node(graph, node_id, port):
+    """沿采样器的 positive/negative 输入向上找到文本编码节点"""
+    seen = set()
+    while node_id not in seen:
+        seen.add(node_id)
+        inputs = graph[node_id]['inputs']
+        for name in TEXT_INPUTS:
+            if isinstance(inputs.get(name), str):
+                return node_id, name
+        link = inputs.get(port)
+        if not _is_link(link):
+            return None
+        node_id = link[0]
+    return None
+
+
+def render_workflow(graph, prompt, seed, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT,
+                    images=(), filename_prefix=None):
+    """把模板工作流套用到单个镜头，返回新的API图"""
+    graph = copy.deepcopy(graph)
+
+    for node_id, node in graph.items():
+        class_type = node.get('class_type')
+        inputs = node['inputs']
+        if class_type in SAMPLER_TYPES:
+            for name in SEED_INPUTS:
+                if name in inputs:
+                    inputs[name] = seed
+            positive = inputs.get('positive')
+            if _is_link(positive):
+                target = _find_text_node(graph, positive[0], 'positive')
+                if target:
+                    graph[target[0]]['inputs'][target[1]] = prompt
+        elif class_type in LATENT_TYPES:
+            inputs['width'] = width
+            inputs['height'] = height
+        elif class_type in OUTPUT_TYPES and filename_prefix:
+            inputs['filename_prefix'] = filename_prefix
+
+    # 编辑工作流（如qwen-edit）的采样器从参考图的VAEEncode取latent，空latent节点
+    # 没有接上，输出尺寸会跟随参考图。denoise为1时编码的latent只提供尺寸，
+    # 改接到空latent节点，分辨率才会生效
+    empty_latents = sorted((nid for nid, n in graph.items() if n.get('class_type') in EMPTY_LATENT_TYPES),
+                           key=_node_sort_key)
+    for node in graph.values():
+        inputs = node['inputs']
+        source = inputs.get('latent_image')
+        if (empty_latents and node.get('class_type') in SAMPLER_TYPES and _is_link(source)
+                and graph[source[0]].get('class_type', '').startswith('VAEEncode')
+                and inputs.get('denoise', 1) >= 1):
+            inputs['latent_image'] = [empty_latents[0], 0]
+
+    # 参考图按节点编号顺序依次填入LoadImage，多余的LoadImage连同引用它的输入一起去掉
+    load_nodes = sorted((nid for nid, n in graph.items() if n.get('class_type') == 'LoadImage'),
+                        key=_node_sort_key)
+    for node_id, image in zip(load_nodes, images):
+        graph[node_id]['inputs']['image'] = image
+    if images:
+        for node_id in load_nodes[len(images):]:
+            del graph[node_id]
+            for node in graph.values():
+                for name, value in list(node['inputs'].items()):
+                    if _is_link(value) and value[0] == node_id:
+                        del node['inputs'][name]
+    return graph
+
+
+def shot_seed(episode, shot_number, base_seed=None):
+    """每个镜头固定的种子，重跑时画面可复现"""
+    if base_seed is not None:
+        return base_seed
+    return int(text_hash(f'Episode-{episode:02d}-{shot_number}')[:12], 16)
+
+
+def build_jobs(run_dir, workflow, edit_workflow=None, refs_dir=None, episodes=None,
+               width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, seed=None, skip_existing=True):
+    """为运行目录中的镜头生成提交任务，按加载器签名分组排序"""
+    templates = {}
+
+    def template(name):
+        if name not in templates:
+            graph = load_workflow(name)
+            templates[name] = (graph, loader_signature(graph))
+        return templates[name]
+
+    jobs = []
+    for episode in episodes or find_episodes(run_dir):
+        prompt_file = os.path.join(run_dir, PROMPTS_DIR, f'Episode-{episode:02d}-Prompts.json')
+        with open(prompt_file, 'r', encoding='utf-8') as f:
+            shots = [shot for shot in json.load(f) if shot.get('shot_number')]
+        image_dir = os.path.join(run_dir, '03_generated_images', f'Episode-{episode:02d}')
+        for shot in shots:
+            dest = os.path.join(image_dir, shot_filename(episode, shot['shot_number']))
+            if skip_existing and os.path.exists(dest):
+                continue
+            refs = []
+            if refs_dir and edit_workflow:
+                refs = [os.path.join(refs_dir, ref) for ref in shot.get('character_refs') or []
+                        if os.path.exists(os.path.join(refs_dir, ref))]
+            graph, signature = template(edit_workflow if refs else workflow)
+            jobs.append({
+                'episode': episode,
+                'shot': shot,
+                'graph': graph,
+                'signature': signature,
+                'refs': refs,
+                'seed': shot_seed(episode, shot['shot_number'], seed),
+                'width': width,
+                'height': height,
+                'dest': dest,
+            })
+
+    # 稳定排序：同一签名的镜头连续提交，组内保持原有顺序
+    first_seen = {}
+    for job in jobs:
+        first_seen.setdefault(job['signature'], len(first_seen))
+    jobs.sort(key=lambda job: first_seen[job['signature']])
+    return jobs
+
+
+class ComfyUIClient:
+    """ComfyUI HTTP + websocket 客户端，所有HTTP请求复用一个连接"""
+
+    def __init__(self, host='127.0.0.1:8188', timeout=60):
+        self.host = host
+        self.timeout = timeout
+        self.client_id = uuid.uuid4().hex
+        self._conn = None
+        self._ws = None
+        self._uploaded = {}
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, timeout=self.timeout)
+        return self._conn
+
+    def request(self, method, path, body=None, headers=None):
+        """发送请求并返回 (状态码, 响应体)，连接断开时重连一次"""
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+
+    def _json(self, method, path, payload=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        status, data = self.request(method, path, body, {'Content-Type': 'application/json'})
+        if status != 200:
+            raise RuntimeError(f'ComfyUI {method} {path} 返回 {status}: {data[:200]!r}')
+        return json.loads(data)
+
+    def upload_image(self, path):
+        """上传参考图到ComfyUI的input目录，相同内容只上传一次"""
+        digest = file_hash(path)
+        if digest in self._uploaded:
+            return self._uploaded[digest]
+        boundary = uuid.uuid4().hex
+        name = f'{digest[:16]}{os.path.splitext(path)[1]}'
+        with open(path, 'rb') as f:
+            content = f.read()
+        body = b''.join([
+            f'--{boundary}\r\n'.encode(),
+            f'Content-Disposition: form-data; name="image"; filename="{name}"\r\n'.encode(),
+            b'Content-Type: application/octet-stream\r\n\r\n', content, b'\r\n',
+            f'--{boundary}\r\n'.encode(),
+            b'Content-Disposition: form-data; name="overwrite"\r\n\r\ntrue\r\n',
+            f'--{boundary}--\r\n'.encode(),
+        ])
+        status, data = self.request('POST', '/upload/image', body,
+                                    {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        if status != 200:
+            raise RuntimeError(f'上传参考图失败 {path}: {status}')
+        result = json.loads(data)
+        uploaded = f"{result['subfolder']}/{result['name']}" if result.get('subfolder') else result['name']
+        self._uploaded[digest] = uploaded
+        return uploaded
+
+    def queue_prompt(self, graph):
+        """提交到队列，返回prompt_id"""
+        result = self._json('POST', '/prompt', {'prompt': graph, 'client_id': self.client_id})
+        if result.get('node_errors'):
+            raise RuntimeError(f"工作流校验失败: {result['node_errors']}")
+        return result['prompt_id']
+
+    def history(self, prompt_id):
+        return self._json('GET', f'/history/{prompt_id}')
+
+    def fetch_output(self, image):
+        query = urllib.parse.urlencode({
+            'filename': image['filename'],
+            'subfolder': image.get('subfolder', ''),
+            'type': image.get('type', 'output'),
+        })
+        status, data = self.request('GET', f'/view?{query}')
+        if status != 200:
+            raise RuntimeError(f"下载输出失败 {image['filename']}: {status}")
+        return data
+
+    def connect(self):
+        """建立websocket连接，必须在提交任务之前调用才能收到全部事件"""
+        self._ws = websocket.WebSocket()
+        self._ws.connect(f'ws://{self.host}/ws?clientId={self.client_id}', timeout=self.timeout)
+        # 加载模型时可能长时间没有事件，接收时不设超时
+        self._ws.settimeout(None)
+
+    def messages(self):
+        """逐条产出websocket上的JSON事件（跳过二进制预览帧）"""
+        while True:
+            message = self._ws.recv()
+            if isinstance(message, str):
+                yield json.loads(message)
+
+    def close(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def _print_progress(job, value, maximum):
+    shot = job['shot']['shot_number']
+    print(f"  第{job['episode']}集 {shot}: {value}/{maximum}", flush=True)
+
+
+def run_jobs(client, jobs, run_dir, on_progress=_print_progress, tracer=None):
+    """提交全部任务并通过websocket接收进度和结果，返回 (成功数, 失败数)
+
+    每个镜头从入队到收到结果记为一个区间，写入tracer。
+    """
+    if not jobs:
+        return 0, 0
+    tracer = tracer or RunTracer()
+
+    statuses = {}
+    for episode in sorted({job['episode'] for job in jobs}):
+        prompt_file = os.path.join(run_dir, PROMPTS_DIR, f'Episode-{episode:02d}-Prompts.json')
+        with open(prompt_file, 'r', encoding='utf-8') as f:
+            shots = [shot for shot in json.load(f) if shot.get('shot_number')]
+        statuses[episode] = EpisodeStatus(run_dir, episode, shots)
+        statuses[episode].save()
+
+    client.connect()
+    pending = {}
+    for job in jobs:
+        episode, shot_number = job['episode'], job['shot']['shot_number']
+        graph = render_workflow(
+            job['graph'], job['shot']['prompt'], job['seed'], job['width'], job['height'],
+            images=[client.upload_image(path) for path in job['refs']],
+            filename_prefix=f'Episode-{episode:02d}/{os.path.splitext(os.path.basename(job["dest"]))[0]}',
+        )
+        job['span'] = tracer.start(shot_number, 'shot', episode=episode)
+        pending[client.queue_prompt(graph)] = job
+        statuses[episode].mark(shot_number, status='queued')
+
+    ok = failed = 0
+    for event in client.messages():
+        data = event.get('data', {})
+        job = pending.get(data.get('prompt_id'))
+        if job is None:
+            continue
+        kind = event.get('type')
+        status = statuses[job['episode']]
+        shot_number = job['shot']['shot_number']
+
+        if kind == 'progress' and on_progress:
+            on_progress(job, data.get('value'), data.get('max'))
+        elif kind == 'executed':
+            outputs = (data.get('output') or {}).get('images') or []
+            if outputs:
+                write_image(job['dest'], client.fetch_output(outputs[0]))
+                status.mark(shot_number, status='generated', error='')
+                job['done'] = True
+        elif kind == 'execution_error':
+            status.mark(shot_number, status='failed', error=data.get('exception_message', ''))
+            pending.pop(data['prompt_id'])
+            job['span'].finish(error=data.get('exception_message') or 'execution_error')
+            failed += 1
+        elif kind == 'executing' and data.get('node') is None:
+            # node为None表示这个prompt整体执行结束
+            job = pending.pop(data['prompt_id'])
+            if not job.get('done'):
+                # 输出命中ComfyUI缓存时不会推送executed，从history取结果
+                history = client.history(data['prompt_id']).get(data['prompt_id'], {})
+                for output in history.get('outputs', {}).values():
+                    if output.get('images'):
+                        write_image(job['dest'], client.fetch_output(output['images'][0]))
+                        status.mark(shot_number, status='generated', error='')
+                        job['done'] = True
+                        break
+            if job.get('done'):
+                job['span'].finish()
+                ok += 1
+            else:
+                status.mark(shot_number, status='failed', error='no image output')
+                job['span'].finish(error='no image output')
+                failed += 1
+        if not pending:
+            break
+    return ok, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地ComfyUI批量提交引擎')
+    parser.add_argument('run_dir')
+    parser.add_argument('--host', default='127.0.0.1:8188')
+    parser.add_argument('--workflow', default='image_z_image_turbo_with_negative.json')
+    parser.add_argument('--edit-workflow', help='有参考图的镜头使用的工作流，例如 qwen-edit.json')
+    parser.add_argument('--refs-dir', help='角色/场景参考图目录')
+    parser.add_argument('--episodes', type=lambda s: [int(x) for x in s.split(',')])
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH)
+    parser.add_argument('--height', type=int, default=DEFAULT_HEIGHT)
+    parser.add_argument('--seed', type=int, help='固定种子（默认按镜头编号生成）')
+    args = parser.parse_args(argv)
+
+    jobs = build_jobs(args.run_dir, args.workflow, args.edit_workflow, args.refs_dir,
+                      args.episodes, args.width, args.height, args.seed)
+    groups = len({job['signature'] for job in jobs})
+    print(f"🚀 提交 {len(jobs)} 个镜头，{groups} 组模型配置")
+
+    client = ComfyUIClient(args.host)
+    tracer = RunTracer(args.run_dir)
+    try:
+        with tracer.stage('images', backend='comfyui', groups=groups):
+            ok, failed = run_jobs(client, jobs, args.run_dir, tracer=tracer)
+    finally:
+        client.close()
+        tracer.save()
+    print(f"{'✅' if not failed else '⚠️'} 完成 {ok} 个，失败 {failed} 个")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成图像的后处理：无损压缩、缩略图、跨运行去重
+
+对 03_generated_images 下的每张图像（进程池并行）：
+1. 无损压缩：真正的PNG重新编码，保留ComfyUI写入的prompt/workflow文本块；
+   Seedream返回的".png"实际是JPEG数据，重新编码会有损或变大，只在系统装有
+   jpegtran 时做无损的霍夫曼表优化，否则保持原字节。结果只在变小时采用。
+2. 缩略图：03_generated_images/thumbnails/<相对路径>.jpg（默认最长边256），
+   JPEG源图用draft按DCT缩放解码，不需要解出全尺寸像素。
+   production_summary.py 直接把缩略图嵌入镜头工作表。
+3. 去重：图像按内容哈希存入 run_cache 的共享对象库（outputs/.cache/objects），
+   运行目录里的文件换成指向对象库的硬链接，多个运行中相同的图像只占一份磁盘。
+   对象库里的文件是只读的，后续重新生成镜头时调度器用 os.replace 换掉链接，
+   不会改动其它运行共享的内容。
+
+处理记录保存在 03_generated_images/.assets.json，文件大小和修改时间没变
+的图像不会重复处理。
+
+依赖：Pillow
+
+用法：
+    python scripts/image_assets.py outputs/run_xxx
+    python scripts/image_assets.py outputs/run_xxx --thumb-size 320 --workers 4
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, PngImagePlugin
+
+from run_cache import DEFAULT_CACHE_DIR, RunCache, atomic_write_json, cache_key, file_hash
+from run_trace import RunTracer
+
+IMAGES_DIR = '03_generated_images'
+THUMBS_DIR = 'thumbnails'
+ASSETS_FILE = '.assets.json'
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+DEFAULT_THUMB_SIZE = 256
+# zlib压缩级别：9最小但2560x1440的PNG要十几秒一张，7约快4倍、只大3%，默认用7；
+# 需要最小体积时用 --png-level 9
+DEFAULT_PNG_LEVEL = 7
+THUMB_QUALITY = 80
+
+
+def find_images(image_root):
+    """递归列出图像文件（相对路径），跳过缩略图目录和以.开头的缓存目录"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(image_root):
+        if dirpath == image_root:
+            dirnames[:] = [d for d in dirnames if d != THUMBS_DIR]
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTS):
+                found.append(os.path.relpath(os.path.join(dirpath, name), image_root))
+    return found
+
+
+def thumbnail_path(image_root, rel):
+    return os.path.join(image_root, THUMBS_DIR, os.path.splitext(rel)[0] + '.jpg')
+
+
+def _optimize_jpeg(src, dest):
+    jpegtran = shutil.which('jpegtran')
+    if not jpegtran:
+        return False
+    result = subprocess.run(
+        [jpegtran, '-copy', 'all', '-optimize', '-outfile', dest, src],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def _png_text(image):
+    """原图的tEXt/zTXt/iTXt文本块（ComfyUI把prompt和workflow存在这里），重新编码时写回"""
+    info = PngImagePlugin.PngInfo()
+    for key, value in image.text.items():
+        # workflow这类大段JSON压缩存储，读取方得到的文本不变
+        info.add_text(key, value, zip=len(value) > 1024)
+    return info
+
+
+def process_image(src, thumb, optimized, thumb_size=DEFAULT_THUMB_SIZE, png_level=DEFAULT_PNG_LEVEL):
+    """处理一张图像：无损压缩到optimized（变小时才保留）并生成缩略图
+
+    返回处理结果；压缩后的文件由主进程负责入库和替换。
+    """
+    tracer = RunTracer()
+    with tracer.span(os.path.basename(src), 'image') as span:
+        original_bytes = os.path.getsize(src)
+        with Image.open(src) as image:
+            fmt = image.format
+            size = image.size
+            if fmt == 'PNG':
+                # Pillow会沿用原图的调色板、透明色和ICC配置，文本块需要显式传入
+                image.save(optimized, 'PNG', compress_level=png_level, pnginfo=_png_text(image))
+                done = True
+            else:
+                done = fmt == 'JPEG' and _optimize_jpeg(src, optimized)
+
+            if fmt == 'JPEG':
+                # 按DCT缩放解码，只解出略大于缩略图的像素
+                image.draft('RGB', (thumb_size * 2, thumb_size * 2))
+            image.thumbnail((thumb_size, thumb_size), reducing_gap=2.0)
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            image.convert('RGB').save(thumb, 'JPEG', quality=THUMB_QUALITY, optimize=True)
+
+        optimized_bytes = os.path.getsize(optimized) if done else original_bytes
+        if done and optimized_bytes >= original_bytes:
+            os.remove(optimized)
+            done = False
+            optimized_bytes = original_bytes
+        final = optimized if done else src
+        span.args.update(format=fmt, saved_bytes=original_bytes - optimized_bytes)
+    return {
+        'format': fmt,
+        'width': size[0],
+        'height': size[1],
+        'original_bytes': original_bytes,
+        'bytes': optimized_bytes,
+        'optimized': done,
+        'sha256': file_hash(final),
+        'records': tracer.records,
+    }
+
+
+class AssetProcessor:
+    """一个运行目录的图像后处理"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, thumb_size=DEFAULT_THUMB_SIZE,
+                 png_level=DEFAULT_PNG_LEVEL, workers=None, parallel_threshold=2, link=True):
+        self.cache = RunCache(cache_dir)
+        self.thumb_size = thumb_size
+        self.png_level = png_level
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.link = link
+
+    def process_run(self, run_dir, tracer=None):
+        """处理运行目录中新增或变化的图像，返回统计数据"""
+        tracer = tracer or RunTracer()
+        image_root = os.path.join(run_dir, IMAGES_DIR)
+        manifest_path = os.path.join(image_root, ASSETS_FILE)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get('thumb_size') != self.thumb_size:
+            manifest = {'thumb_size': self.thumb_size, 'images': {}}
+        images = find_images(image_root)
+        # 已删除的图像不再保留记录
+        records = manifest['images'] = {
+            rel: manifest['images'][rel] for rel in images if rel in manifest['images']
+        }
+
+        todo = []
+        for rel in images:
+            src = os.path.join(image_root, rel)
+            stat = os.stat(src)
+            entry = records.get(rel)
+            if (entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+                    and os.path.exists(thumbnail_path(image_root, rel))):
+                continue
+            todo.append(rel)
+
+        args = [
+            (os.path.join(image_root, rel), thumbnail_path(image_root, rel),
+             os.path.join(image_root, f'{rel}.opt{os.getpid()}'), self.thumb_size, self.png_level)
+            for rel in todo
+        ]
+        if len(args) >= self.parallel_threshold:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(process_image, *zip(*args)))
+        else:
+            results = [process_image(*arg) for arg in args]
+
+        stats = {'images': 0, 'processed': 0, 'optimized': 0, 'deduplicated': 0,
+                 'original_bytes': 0, 'bytes': 0}
+        for rel, arg, result in zip(todo, args, results):
+            tracer.adopt(result.pop('records'))
+            src, _, optimized = arg[:3]
+            final = optimized if result['optimized'] else src
+            digest = result['sha256']
+            key = cache_key('asset', digest)
+            if digest in self.cache.objects and os.path.exists(self.cache.object_path(digest)):
+                stats['deduplicated'] += 1
+            self.cache.store(key, final, 'asset')
+            if self.link or result['optimized']:
+                self.cache.materialize(key, src, link=self.link)
+            if result['optimized']:
+                os.remove(optimized)
+                stats['optimized'] += 1
+
+            stat = os.stat(src)
+            result.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                          thumbnail=os.path.relpath(thumbnail_path(image_root, rel), image_root))
+            records[rel] = result
+            stats['processed'] += 1
+
+        stats['images'] = len(records)
+        for entry in records.values():
+            stats['original_bytes'] += entry['original_bytes']
+            stats['bytes'] += entry['bytes']
+        self.cache.evict()
+        self.cache.save()
+        atomic_write_json(manifest_path, manifest, indent=None)
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成图像的后处理：无损压缩、缩略图、跨运行去重')
+    parser.add_argument('run_dir')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--thumb-size', type=int, default=DEFAULT_THUMB_SIZE, help='缩略图最长边（像素）')
+    parser.add_argument('--png-level', type=int, default=DEFAULT_PNG_LEVEL, choices=range(10),
+                        metavar='0-9', help='PNG的zlib压缩级别')
+    parser.add_argument('--workers', type=int, help='进程池大小（默认CPU核数）')
+    parser.add_argument('--no-link', action='store_true', help='运行目录保留独立副本，不换成硬链接')
+    args = parser.parse_args(argv)
+
+    processor = AssetProcessor(args.cache_dir, args.thumb_size, args.png_level, args.workers,
+                               link=not args.no_link)
+    tracer = RunTracer(args.run_dir)
+    with tracer.stage('assets'):
+        stats = processor.process_run(args.run_dir, tracer)
+    tracer.save()
+
+    saved = stats['original_bytes'] - stats['bytes']
+    print(f"✅ 图像后处理完成：共{stats['images']}张，本次处理{stats['processed']}张，"
+          f"无损压缩{stats['optimized']}张，与已有图像重复{stats['deduplicated']}张")
+    print(f"📊 压缩节省 {saved / 1024 ** 2:.2f}MB（{stats['original_bytes'] / 1024 ** 2:.2f}MB → "
+          f"{stats['bytes'] / 1024 ** 2:.2f}MB）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像生成并发调度器
+
+读取 02_image_prompts/Episode-XX-Prompts.json，把镜头并发提交给图像后端：
+- 并发数可配置（asyncio.Semaphore）
+- 令牌桶限速，避免触发接口QPS限制
+- 单镜头超时 + 指数退避重试
+- 每个镜头完成后原子更新 generation_status.json
+- 每集、每个镜头的耗时和重试次数记入运行目录的 trace.json（见 run_trace.py）
+
+状态文件只在图像文件落盘之后才标记为 generated，启动时会先按磁盘上的
+文件校正状态，因此中断后重新运行会从中断处继续，状态与实际文件始终一致。
+
+用法：
+    python scripts/image_scheduler.py outputs/run_xxx --episodes 1-3 --concurrency 4 --rate 2
+    python scripts/image_scheduler.py outputs/run_xxx --backend stub    # 本地桩后端，不调用接口
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import struct
+import sys
+import time
+import urllib.request
+import zlib
+from datetime import datetime
+
+from run_cache import atomic_write_json, text_hash
+from run_trace import RunTracer
+
+PROMPTS_DIR = '02_image_prompts'
+IMAGES_DIR = '03_generated_images'
+STATUS_FILE = 'generation_status.json'
+PROMPT_FILE_RE = re.compile(r'^Episode-(\d+)-Prompts\.json$')
+
+ARK_IMAGES_URL = 'https://ark.cn-beijing.volces.com/api/v3/images/generations'
+
+
+class TokenBucket:
+    """令牌桶限速：每秒补充rate个令牌，最多积累capacity个"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _png_bytes(width, height, seed):
+    """生成一张纯色渐变PNG，供桩后端使用"""
+    rnd = random.Random(seed)
+    base = [rnd.randrange(256) for _ in range(3)]
+    rows = []
+    for y in range(height):
+        shade = [(c + y * 2) % 256 for c in base]
+        rows.append(b'\x00' + bytes(shade) * width)
+    raw = zlib.compress(b''.join(rows))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', raw) + chunk(b'IEND', b'')
+
+
+class StubBackend:
+    """本地桩后端：按提示词哈希生成小尺寸PNG，可模拟延迟和随机失败"""
+
+    def __init__(self, latency=0.05, failure_rate=0.0, size=(64, 36)):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.size = size
+        self.calls = 0
+
+    async def generate(self, shot):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise RuntimeError('stub backend: simulated failure')
+        return _png_bytes(*self.size, seed=text_hash(shot.get('prompt', '')))
+
+
+class ArkImageBackend:
+    """豆包 Seedream 图像接口（OpenAI兼容的 images/generations）"""
+
+    def __init__(self, model, api_key=None, url=ARK_IMAGES_URL, size='1664x936', timeout=120.0):
+        self.model = model
+        self.api_key = api_key or os.environ.get('ARK_API_KEY', '')
+        if not self.api_key:
+            raise ValueError('未设置ARK_API_KEY，无法调用豆包图像接口')
+        self.url = url
+        self.size = size
+        # wait_for超时只是不再等待，线程里的请求要靠socket超时真正结束，
+        # 否则重试会和仍在进行的旧请求重复计费
+        self.timeout = timeout
+
+    def _request(self, prompt):
+        body = json.dumps({
+            'model': self.model,
+            'prompt': prompt,
+            'size': self.size,
+            'response_format': 'b64_json',
+            'watermark': False,
+        }).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}',
+        })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = json.load(response)
+        return base64.b64decode(payload['data'][0]['b64_json'])
+
+    async def generate(self, shot):
+        # urllib是阻塞调用，放到线程里执行，不阻塞事件循环
+        return await asyncio.to_thread(self._request, shot['prompt'])
+
+
+def shot_filename(episode, shot_number):
+    return f'Episode-{episode:02d}-{shot_number}.png'
+
+
+def find_episodes(run_dir):
+    """返回运行目录中所有提示词文件的集数"""
+    prompts_dir = os.path.join(run_dir, PROMPTS_DIR)
+    episodes = []
+    for name in os.listdir(prompts_dir):
+        match = PROMPT_FILE_RE.match(name)
+        if match:
+            episodes.append(int(match.group(1)))
+    return sorted(episodes)
+
+
+class EpisodeStatus:
+    """某一集的generation_status.json，每次更新都原子写回磁盘"""
+
+    def __init__(self, run_dir, episode, shots, engine='', style=''):
+        self.episode = episode
+        self.image_dir = os.path.join(run_dir, IMAGES_DIR, f'Episode-{episode:02d}')
+        self.path = os.path.join(self.image_dir, STATUS_FILE)
+        os.makedirs(self.image_dir, exist_ok=True)
+        self._lock = asyncio.Lock()
+
+        previous = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                previous = {img['shot_number']: img for img in json.load(f).get('images', [])}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self.data = {
+            'episode': episode,
+            'total_shots': len(shots),
+            'generated': 0,
+            'status': 'pending',
+            'engine': engine,
+            'style': style,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'images': [],
+        }
+        self.by_shot = {}
+        for shot in shots:
+            shot_number = shot['shot_number']
+            entry = dict(previous.get(shot_number, {}))
+            entry.update({
+                'shot_number': shot_number,
+                'filename': shot_filename(episode, shot_number),
+                'has_character': shot.get('has_character', False),
+            })
+            if shot.get('characters'):
+                entry['character'] = '、'.join(shot['characters'])
+            # 以磁盘文件为准：声称已生成但文件不存在的镜头重新排队
+            exists = os.path.exists(os.path.join(self.image_dir, entry['filename']))
+            entry['status'] = 'generated' if exists else 'pending'
+            entry.setdefault('attempts', 0)
+            self.data['images'].append(entry)
+            self.by_shot[shot_number] = entry
+        self._refresh_totals()
+
+    def _refresh_totals(self):
+        generated = sum(1 for img in self.data['images'] if img['status'] == 'generated')
+        failed = sum(1 for img in self.data['images'] if img['status'] == 'failed')
+        self.data['generated'] = generated
+        if generated == len(self.data['images']):
+            self.data['status'] = 'completed'
+        elif failed and generated + failed == len(self.data['images']):
+            self.data['status'] = 'failed'
+        else:
+            self.data['status'] = 'in_progress' if generated else 'pending'
+        self.data['timestamp'] = datetime.now().isoformat(timespec='seconds')
+
+    def pending(self):
+        return [img['shot_number'] for img in self.data['images'] if img['status'] != 'generated']
+
+    def save(self):
+        atomic_write_json(self.path, self.data)
+
+    def mark(self, shot_number, **fields):
+        """更新单个镜头并立即写回磁盘"""
+        self.by_shot[shot_number].update(fields)
+        self._refresh_totals()
+        self.save()
+
+    async def update(self, shot_number, **fields):
+        async with self._lock:
+            self.mark(shot_number, **fields)
+
+
+def write_image(path, data):
+    tmp_path = f'{path}.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+async def generate_shot(backend, shot, status, bucket, semaphore,
+                        retries=3, timeout=120.0, backoff=1.0, tracer=None):
+    """生成单个镜头：限速、超时、指数退避重试，成功后写文件再更新状态"""
+    shot_number = shot['shot_number']
+    dest = os.path.join(status.image_dir, shot_filename(status.episode, shot_number))
+    last_error = ''
+    tracer = tracer or RunTracer()
+    async with semaphore:
+        with tracer.span(shot_number, 'shot', episode=status.episode) as span:
+            for attempt in range(1, retries + 2):
+                if attempt > 1:
+                    span.add_retry()
+                await bucket.acquire()
+                try:
+                    data = await asyncio.wait_for(backend.generate(shot), timeout)
+                    await asyncio.to_thread(write_image, dest, data)
+                except Exception as exc:
+                    last_error = f'{type(exc).__name__}: {exc}'
+                    await status.update(shot_number, attempts=attempt, error=last_error)
+                    if attempt > retries:
+                        break
+                    await asyncio.sleep(backoff * 2 ** (attempt - 1) * (1 + random.random() / 2))
+                    continue
+                await status.update(shot_number, status='generated', attempts=attempt, error='')
+                return True
+            span.error = last_error
+    await status.update(shot_number, status='failed', error=last_error)
+    return False
+
+
+async def _generate_episode(backend, shots, status, bucket, semaphore, tracer, **options):
+    pending = set(status.pending())
+    with tracer.span(f'Episode-{status.episode:02d}', 'episode', pending=len(pending)):
+        outcomes = await asyncio.gather(*[
+            generate_shot(backend, shot, status, bucket, semaphore, tracer=tracer, **options)
+            for shot in shots if shot['shot_number'] in pending
+        ])
+    return sum(outcomes), len(outcomes) - sum(outcomes)
+
+
+async def generate_run(run_dir, backend, episodes=None, concurrency=4, rate=2.0,
+                       retries=3, timeout=120.0, backoff=1.0, tracer=None):
+    """并发生成运行目录中所有待生成的镜头，返回 {集数: (成功数, 失败数)}"""
+    info = {}
+    try:
+        with open(os.path.join(run_dir, '00_info.json'), 'r', encoding='utf-8') as f:
+            info = json.load(f).get('parameters', {})
+    except (OSError, ValueError):
+        pass
+
+    tracer = tracer or RunTracer()
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate)
+    tasks = {}
+    for episode in episodes or find_episodes(run_dir):
+        prompt_file = os.path.join(run_dir, PROMPTS_DIR, f'Episode-{episode:02d}-Prompts.json')
+        with open(prompt_file, 'r', encoding='utf-8') as f:
+            shots = [shot for shot in json.load(f) if shot.get('shot_number')]
+        status = EpisodeStatus(run_dir, episode, shots,
+                               engine=info.get('engine', ''), style=info.get('style', ''))
+        status.save()
+        tasks[episode] = asyncio.create_task(_generate_episode(
+            backend, shots, status, bucket, semaphore, tracer,
+            retries=retries, timeout=timeout, backoff=backoff,
+        ))
+
+    return {episode: await task for episode, task in tasks.items()}
+
+
+def _parse_episodes(text):
+    if not text:
+        return None
+    episodes = []
+    for part in text.split(','):
+        if '-' in part:
+            start, end = part.split('-', 1)
+            episodes.extend(range(int(start), int(end) + 1))
+        else:
+            episodes.append(int(part))
+    return episodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='图像生成并发调度器')
+    parser.add_argument('run_dir')
+    parser.add_argument('--episodes', help='例如 1-3 或 1,3')
+    parser.add_argument('--backend', choices=['ark', 'stub'], default='ark')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=2.0, help='每秒最多提交的请求数')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=120.0, help='单镜头超时（秒）')
+    args = parser.parse_args(argv)
+
+    if args.backend == 'stub':
+        backend = StubBackend()
+    else:
+        with open(os.path.join(args.run_dir, '00_info.json'), 'r', encoding='utf-8') as f:
+            engine = json.load(f).get('parameters', {}).get('engine', 'doubao-seedream-4-0-250828')
+        try:
+            backend = ArkImageBackend(engine, timeout=args.timeout)
+        except ValueError as exc:
+            print(f'❌ {exc}')
+            return 1
+
+    tracer = RunTracer(args.run_dir)
+    with tracer.stage('images', backend=args.backend, concurrency=args.concurrency):
+        results = asyncio.run(generate_run(
+            args.run_dir, backend, episodes=_parse_episodes(args.episodes),
+            concurrency=args.concurrency, rate=args.rate,
+            retries=args.retries, timeout=args.timeout, tracer=tracer,
+        ))
+    tracer.save()
+    failed = 0
+    for episode, (ok, bad) in sorted(results.items()):
+        failed += bad
+        print(f"{'✅' if not bad else '⚠️'} 第{episode}集：新生成 {ok} 张，失败 {bad} 张")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+小说章节语料索引
+
+novel/ 下的章节文件命名不统一（"第1章-标题.txt"、"第5章：标题.txt"），
+还有重复章节号（两个第40章）。本脚本扫描一次目录，建立持久化索引：
+    novel/.corpus_index.json
+        每章的文件名、章节号、标题、字节数、字符数、内容哈希、段落字节偏移，
+        以及人物/场景的出现次数
+加载时由此得到章节号 → 章节、人物/场景 → {章节号: 出现次数} 的倒排索引，
+重复的章节号记录在 duplicates 中（按文件名排序取第一个）。
+
+文件大小和修改时间没变的章节直接复用索引，不重新读取。章节内容通过mmap按
+段落流式读取，不需要整章读进内存。按章节范围（如 1-40）解析、按人物查章节
+都是对索引的字典查找，不再扫描全文。
+
+用法：
+    python scripts/novel_corpus.py build
+    python scripts/novel_corpus.py range 1-40
+    python scripts/novel_corpus.py find 林渊 石矶
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+
+from run_cache import atomic_write_json
+
+DEFAULT_NOVEL_DIR = 'novel'
+INDEX_FILE = '.corpus_index.json'
+INDEX_VERSION = 1
+
+CHAPTER_FILE_RE = re.compile(r'^第(\d+)章\s*[-－—：:\s]\s*(.+?)\.txt$')
+CHAPTER_RANGE_RE = re.compile(r'^\s*(\d+)\s*(?:-\s*(\d+))?\s*$')
+
+# 倒排索引收录的人物和场景
+CHARACTERS = (
+    '林渊', '石矶', '哪吒', '姜子牙', '苏小小', '敖丙', '李靖', '殷夫人', '太乙',
+    '申公豹', '元始', '通天', '龙王', '修士', '三霄',
+)
+SCENES = (
+    '陈塘关', '矿洞', '矿场', '李府', '龙宫', '东海', '天庭', '玉虚宫', '昆仑', '封神榜',
+)
+
+
+def parse_chapter_filename(name):
+    """从文件名解析 (章节号, 标题)，不是章节文件时返回None"""
+    match = CHAPTER_FILE_RE.match(name)
+    if not match:
+        return None
+    return int(match.group(1)), match.group(2).strip()
+
+
+def _compile_terms(terms):
+    return re.compile('|'.join(re.escape(t) for t in sorted(set(terms), key=len, reverse=True)))
+
+
+def scan_chapter(path, terms_re):
+    """读取一章，返回字节数、字符数、哈希、段落偏移和词频"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    text = data.decode('utf-8')
+
+    offsets = []
+    position = 0
+    for line in data.splitlines(keepends=True):
+        if line.strip():
+            offsets.append(position)
+        position += len(line)
+
+    counts = {}
+    for match in terms_re.finditer(text):
+        term = match.group()
+        counts[term] = counts.get(term, 0) + 1
+
+    return {
+        'bytes': len(data),
+        'chars': len(text),
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'paragraph_offsets': offsets,
+        'terms': counts,
+    }
+
+
+class NovelCorpus:
+    """novel/目录的持久化索引和流式读取"""
+
+    def __init__(self, novel_dir=DEFAULT_NOVEL_DIR, terms=CHARACTERS + SCENES):
+        self.novel_dir = novel_dir
+        self.index_path = os.path.join(novel_dir, INDEX_FILE)
+        self.terms = tuple(terms)
+        self.chapters = {}
+        self.duplicates = {}
+        self.term_index = {}
+        self._load_or_build()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 收录词变化时旧的词频没有意义，整体重建
+        if index.get('version') != INDEX_VERSION or index.get('term_list') != list(self.terms):
+            return {}
+        return {entry['file']: entry for entry in index.get('files', [])}
+
+    def _load_or_build(self):
+        previous = self._load_index()
+        terms_re = _compile_terms(self.terms)
+        files = []
+        changed = False
+
+        with os.scandir(self.novel_dir) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file())
+        for name in names:
+            parsed = parse_chapter_filename(name)
+            if not parsed:
+                continue
+            stat = os.stat(os.path.join(self.novel_dir, name))
+            entry = previous.get(name)
+            if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                entry = {
+                    'file': name,
+                    'number': parsed[0],
+                    'title': parsed[1],
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                }
+                entry.update(scan_chapter(os.path.join(self.novel_dir, name), terms_re))
+                changed = True
+            files.append(entry)
+
+        if changed or len(files) != len(previous):
+            atomic_write_json(self.index_path, {
+                'version': INDEX_VERSION,
+                'term_list': list(self.terms),
+                'files': files,
+            }, indent=None)
+
+        self.chapters = {}
+        self.duplicates = {}
+        self.term_index = {}
+        for entry in files:
+            number = entry['number']
+            if number in self.chapters:
+                self.duplicates.setdefault(number, [self.chapters[number]['file']]).append(entry['file'])
+            else:
+                self.chapters[number] = entry
+            for term, count in entry['terms'].items():
+                self.term_index.setdefault(term, {})
+                self.term_index[term][number] = self.term_index[term].get(number, 0) + count
+
+    def path(self, number):
+        return os.path.join(self.novel_dir, self.chapters[number]['file'])
+
+    def resolve_range(self, text):
+        """解析 "1-40" 或 "5"，返回按章节号排序的章节索引条目，缺失的章节跳过"""
+        match = CHAPTER_RANGE_RE.match(text)
+        if not match:
+            raise ValueError(f'无法解析章节范围: {text}')
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        return [self.chapters[n] for n in range(start, end + 1) if n in self.chapters]
+
+    def chapters_with(self, term):
+        """返回提到某个人物/场景的 {章节号: 出现次数}"""
+        return self.term_index.get(term, {})
+
+    def read_chapter(self, number):
+        """读取整章文本"""
+        with open(self.path(number), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def iter_paragraphs(self, number):
+        """通过mmap按段落流式读取一章，不把整章解码进内存"""
+        entry = self.chapters[number]
+        offsets = entry['paragraph_offsets']
+        if not offsets:
+            return
+        with open(self.path(number), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                ends = offsets[1:] + [len(mm)]
+                for start, end in zip(offsets, ends):
+                    yield mm[start:end].decode('utf-8').strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='小说章节语料索引')
+    parser.add_argument('action', choices=['build', 'range', 'find'])
+    parser.add_argument('args', nargs='*')
+    parser.add_argument('--novel-dir', default=DEFAULT_NOVEL_DIR)
+    args = parser.parse_args(argv)
+
+    corpus = NovelCorpus(args.novel_dir)
+    for number, files in sorted(corpus.duplicates.items()):
+        print(f"⚠️ 第{number}章有重复文件：{'、'.join(files)}（使用 {files[0]}）")
+
+    if args.action == 'build':
+        total_chars = sum(entry['chars'] for entry in corpus.chapters.values())
+        print(f"✅ 已索引 {len(corpus.chapters)} 章，共 {total_chars} 字")
+    elif args.action == 'range':
+        for entry in corpus.resolve_range(args.args[0] if args.args else '1-9999'):
+            print(f"第{entry['number']}章 {entry['title']}（{entry['chars']}字）")
+    else:
+        for term in args.args:
+            hits = corpus.chapters_with(term)
+            chapters = '、'.join(f'{n}({c})' for n, c in sorted(hits.items()))
+            print(f"{term}: {chapters or '未出现'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示词批量验证脚本（设计见 docs/2024-12-23-prompt-quality-optimization-design.md 3.3节）
+
+所有检查规则编译成一个组合正则，每一集的提示词拼接后只扫描一遍：
+- 角色服装描述（【服装：...】）
+- 风格锚定词（至少3个）
+- 质量约束词
+- 【图X参考角色】与角色列表是否对应
+- 参考图是否存在（每个参考图目录只列一次，结果缓存）；用别名写的参考图
+  （如 linxuan.png）按 references/registry.json 自动替换为标准参考图
+- 长度控制（140-260字）
+
+多集时按集分配到进程池并行验证。上次验证过且提示词、参考图目录都没有变化
+的镜头直接复用缓存结果。验证报告和修复后的JSON一次写出：
+    02.5_validation/validation_report.md
+    02.5_validation/fixed_prompts.json
+
+用法：
+    python scripts/prompt_validator.py outputs/run_xxx --refs-dir references/
+"""
+
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from character_registry import CharacterRegistry
+from run_cache import atomic_write_json, file_hash, text_hash
+from run_trace import RunTracer
+
+PROMPTS_DIR = '02_image_prompts'
+VALIDATION_DIR = '02.5_validation'
+CACHE_FILE = '.validation_cache.json'
+PROMPT_FILE_RE = re.compile(r'^Episode-(\d+)-Prompts\.json$')
+
+# 修改规则时同步提升版本号，使缓存的验证结果失效
+RULES_VERSION = 3
+
+# 风格锚定词库（设计文档 3.1.3）
+STYLE_ANCHORS = (
+    '仙侠动漫风格', '中国玄幻国风动漫风格', '色彩鲜明对比强烈', '流畅线条',
+    '戏剧性', '悲壮感', '威严', '压迫感',
+)
+MIN_STYLE_ANCHORS = 3
+
+QUALITY_CONSTRAINTS = (
+    '光影统一符合场景氛围',
+    '画面干净不要文字水印logo',
+    '不要畸形手指和多余肢体',
+)
+# 只对有角色的镜头要求
+CHARACTER_CONSTRAINTS = (
+    '角色动作精准比例正常',
+)
+
+MIN_LENGTH = 140
+MAX_LENGTH = 260
+
+# 提示词之间的分隔符，不会出现在正常文本里；规则中唯一的变长字符类（参考图标记）
+# 排除了分隔符中的字符，保证匹配不会跨越两个镜头
+SEPARATOR = '\n\x00\n'
+
+CN_NUMERALS = '一二三四五六七八九十'
+# 参考图标记可以合写：【图一参考林渊，图二参考青袍修士】
+BIND_ITEM_RE = re.compile(rf'图[{CN_NUMERALS}\d]+参考([^，,、】]+)')
+
+
+def compile_rules():
+    """把所有规则编译成一个组合正则，每类规则一个命名分组，match.lastgroup即规则类别"""
+    def alternation(terms):
+        # 长词优先，避免短词抢先匹配
+        return '|'.join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+
+    return re.compile(
+        rf'(?P<style>{alternation(STYLE_ANCHORS)})'
+        rf'|(?P<quality>{alternation(QUALITY_CONSTRAINTS + CHARACTER_CONSTRAINTS)})'
+        r'|(?P<costume>【服装[：:])'
+        rf'|【(?P<bind>图[{CN_NUMERALS}\d]+参考[^】\x00\n]+)】'
+    )
+
+
+RULES = compile_rules()
+
+
+def list_refs(refs_dir):
+    """列出参考图目录中的文件名，目录不存在时返回空集合"""
+    if not refs_dir:
+        return frozenset()
+    try:
+        with os.scandir(refs_dir) as entries:
+            return frozenset(entry.name for entry in entries if entry.is_file())
+    except OSError:
+        return frozenset()
+
+
+def find_episode_files(run_dir):
+    prompts_dir = os.path.join(run_dir, PROMPTS_DIR)
+    files = []
+    for name in os.listdir(prompts_dir):
+        match = PROMPT_FILE_RE.match(name)
+        if match:
+            files.append((int(match.group(1)), os.path.join(prompts_dir, name)))
+    return sorted(files)
+
+
+def _scan(prompts):
+    """把一集的提示词拼接后用组合正则扫描一遍，返回每个镜头的匹配结果"""
+    text = SEPARATOR.join(prompts)
+    starts = []
+    offset = 0
+    for prompt in prompts:
+        starts.append(offset)
+        offset += len(prompt) + len(SEPARATOR)
+
+    found = [{'style': set(), 'quality': set(), 'costume': set(), 'bind': set()} for _ in prompts]
+    bisect_right = bisect.bisect_right
+    for match in RULES.finditer(text):
+        kind = match.lastgroup
+        hits = found[bisect_right(starts, match.start()) - 1]
+        if kind == 'bind':
+            hits['bind'].update(name.strip() for name in BIND_ITEM_RE.findall(match.group(kind)))
+        else:
+            hits[kind].add(match.group(kind))
+    return found
+
+
+def _image_label(number):
+    return f'图{CN_NUMERALS[number - 1]}' if number <= len(CN_NUMERALS) else f'图{number}'
+
+
+def _ref_number(name, position, refs, aliases):
+    """角色对应第几张参考图：按character_refs中同名（含别名替换后）参考图的位置，
+    找不到时按角色在characters中的位置"""
+    for index, ref in enumerate(refs, start=1):
+        if os.path.splitext(aliases.get(ref, ref))[0] == name:
+            return index
+    return position
+
+
+def check_shot(shot, hits, refs, aliases=None):
+    """根据扫描结果检查单个镜头，返回验证结果（含修复后的提示词）
+
+    aliases为 别名文件名 → 已存在的标准参考图，用于修正写错名字的参考图
+    """
+    prompt = shot.get('prompt', '')
+    characters = shot.get('characters') or []
+    issues = []
+    warnings = []
+    manual = False
+    fixed_prompt = prompt
+    fixed_refs = list(shot.get('character_refs') or [])
+
+    if shot.get('has_character') and not hits['costume']:
+        issues.append('缺少角色服装描述')
+        manual = True
+
+    unbound = [(position, name) for position, name in enumerate(characters, start=1)
+               if name not in hits['bind']]
+    if unbound:
+        tags = []
+        for position, name in unbound:
+            issues.append(f'角色未绑定参考图标记: {name}')
+            number = _ref_number(name, position, fixed_refs, aliases or {})
+            tags.append(f'{_image_label(number)}参考{name}')
+        fixed_prompt = f"【{'，'.join(tags)}】" + fixed_prompt
+
+    missing_refs = [ref for ref in fixed_refs if ref not in refs]
+    if missing_refs:
+        aliases = aliases or {}
+        for ref in missing_refs:
+            if ref in aliases:
+                issues.append(f'角色参考图名称不规范: {ref} → {aliases[ref]}')
+            else:
+                issues.append(f'角色参考图不存在: {ref}')
+        fixed_refs = list(dict.fromkeys(
+            aliases.get(ref, ref) for ref in fixed_refs if ref in refs or ref in aliases
+        ))
+
+    suffix = []
+    if len(hits['style']) < MIN_STYLE_ANCHORS:
+        issues.append(f"风格锚定词不足（找到{len(hits['style'])}个，需要至少{MIN_STYLE_ANCHORS}个）")
+        needed = MIN_STYLE_ANCHORS - len(hits['style'])
+        suffix.extend([t for t in STYLE_ANCHORS if t not in hits['style']][:needed])
+    required = QUALITY_CONSTRAINTS + (CHARACTER_CONSTRAINTS if shot.get('has_character') else ())
+    for term in required:
+        if term not in hits['quality']:
+            issues.append(f'缺少质量约束: {term}')
+            suffix.append(term)
+    if suffix:
+        fixed_prompt = fixed_prompt.rstrip('。') + '，' + '，'.join(suffix) + '。'
+
+    if len(prompt) < MIN_LENGTH:
+        warnings.append(f'提示词过短（{len(prompt)}字，建议{MIN_LENGTH}-{MAX_LENGTH}字）')
+    elif len(prompt) > MAX_LENGTH:
+        warnings.append(f'提示词过长（{len(prompt)}字，建议{MIN_LENGTH}-{MAX_LENGTH}字）')
+
+    refs_changed = fixed_refs != (shot.get('character_refs') or [])
+    return {
+        'is_valid': not issues,
+        'issues': issues,
+        'warnings': warnings,
+        'needs_manual': manual,
+        'fixed_prompt': fixed_prompt if fixed_prompt != prompt or refs_changed else None,
+        'fixed_refs': fixed_refs if refs_changed else None,
+    }
+
+
+def validate_episode(episode, prompt_file, refs, cached, aliases=None):
+    """验证一集，cached为 {镜头编号: [指纹, 结果]}，指纹未变的镜头直接复用
+
+    返回 (集数, [(镜头编号, 指纹, 结果)], 本次实际检查的镜头数)
+    """
+    with open(prompt_file, 'r', encoding='utf-8') as f:
+        shots = [shot for shot in json.load(f) if shot.get('shot_number')]
+
+    results = [None] * len(shots)
+    fingerprints = []
+    todo = []
+    for index, shot in enumerate(shots):
+        fingerprint = text_hash('\0'.join([
+            shot.get('prompt', ''),
+            '|'.join(shot.get('characters') or []),
+            '|'.join(shot.get('character_refs') or []),
+            '1' if shot.get('has_character') else '0',
+        ]))
+        fingerprints.append(fingerprint)
+        previous = cached.get(shot['shot_number'])
+        if previous and previous[0] == fingerprint:
+            results[index] = previous[1]
+        else:
+            todo.append(index)
+
+    if todo:
+        found = _scan([shots[i].get('prompt', '') for i in todo])
+        for index, hits in zip(todo, found):
+            results[index] = check_shot(shots[index], hits, refs, aliases)
+
+    return episode, [
+        (shot['shot_number'], fingerprint, result)
+        for shot, fingerprint, result in zip(shots, fingerprints, results)
+    ], len(todo)
+
+
+def _traced_validate_episode(*args):
+    """在worker里计时验证一集，区间记录随结果一起传回主进程"""
+    tracer = RunTracer()
+    with tracer.span(f'Episode-{args[0]:02d}', 'episode') as span:
+        result = validate_episode(*args)
+        span.args['checked'] = result[2]
+    return result, tracer.records
+
+
+def _write_json_rows(path, rows):
+    """写出JSON数组，每个元素占一行：便于阅读和diff，同时能用json的C编码器"""
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        f.write(',\n'.join('  ' + json.dumps(row, ensure_ascii=False) for row in rows))
+        f.write('\n]\n' if rows else ']\n')
+    os.replace(tmp_path, path)
+
+
+class PromptValidator:
+    """批量验证运行目录中所有集的提示词"""
+
+    def __init__(self, refs_dir=None, workers=None, parallel_threshold=8):
+        self.refs_dir = refs_dir
+        self.refs = list_refs(refs_dir)
+        self.aliases = CharacterRegistry(refs_dir).alias_map(self.refs) if refs_dir else {}
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        # 参考图目录内容和别名表也是验证结果的输入，变化时缓存整体失效
+        self.context = text_hash(json.dumps(
+            [RULES_VERSION, sorted(self.refs), sorted(self.aliases.items())], ensure_ascii=False,
+        ))
+
+    def _load_cache(self, path):
+        """读取上次的验证结果：{集数: {'file': 文件哈希, 'shots': {镜头编号: [指纹, 结果]}}}"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('context') != self.context:
+            return {}
+        return {int(episode): value for episode, value in data.get('episodes', {}).items()}
+
+    def validate_run(self, run_dir, tracer=None):
+        """验证整个运行目录，写出报告和修复后的JSON，返回汇总统计"""
+        tracer = tracer or RunTracer()
+        out_dir = os.path.join(run_dir, VALIDATION_DIR)
+        os.makedirs(out_dir, exist_ok=True)
+        cache_path = os.path.join(out_dir, CACHE_FILE)
+        cache = self._load_cache(cache_path)
+
+        done = {}
+        file_hashes = {}
+        args = []
+        for episode, path in find_episode_files(run_dir):
+            file_hashes[episode] = file_hash(path)
+            cached = cache.get(episode, {})
+            if cached.get('file') == file_hashes[episode]:
+                # 整个文件没有变化，不用解析JSON
+                items = [(shot, fp, result) for shot, (fp, result) in cached['shots'].items()]
+                done[episode] = (episode, items, 0)
+            else:
+                args.append((episode, path, self.refs, cached.get('shots', {}), self.aliases))
+
+        if len(args) >= self.parallel_threshold:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(_traced_validate_episode, *zip(*args)))
+        else:
+            results = [_traced_validate_episode(*arg) for arg in args]
+        for result, records in results:
+            tracer.adopt(records)
+            done[result[0]] = result
+        episodes = [done[episode] for episode in sorted(done)]
+
+        summary = self.write_outputs(out_dir, episodes)
+        atomic_write_json(cache_path, {
+            'context': self.context,
+            'episodes': {
+                str(episode): {
+                    'file': file_hashes[episode],
+                    'shots': {shot: [fp, result] for shot, fp, result in items},
+                }
+                for episode, items, _ in episodes
+            },
+        }, indent=None)
+        return summary
+
+    def write_outputs(self, out_dir, episodes):
+        """一次遍历结果，同时生成验证报告和fixed_prompts.json"""
+        summary = {'总镜头数': 0, '验证通过': 0, '需要修复': 0, '可自动修复': 0, '需要人工处理': 0,
+                   '本次验证': 0}
+        issue_lines = []
+        warning_lines = []
+        fixed = []
+        multi = len(episodes) > 1
+
+        for episode, items, checked in episodes:
+            summary['本次验证'] += checked
+            for shot_number, _, result in items:
+                label = f'第{episode}集 {shot_number}' if multi else shot_number
+                summary['总镜头数'] += 1
+                if result['is_valid']:
+                    summary['验证通过'] += 1
+                else:
+                    summary['需要修复'] += 1
+                    summary['需要人工处理' if result['needs_manual'] else '可自动修复'] += 1
+                    issue_lines.append(f'\n### 镜头 {label}')
+                    issue_lines.extend(f'- {issue}' for issue in result['issues'])
+                warning_lines.extend(f'- Shot {label}: {warning}' for warning in result['warnings'])
+
+                if result['fixed_prompt']:
+                    entry = {
+                        'episode': episode,
+                        'shot_number': shot_number,
+                        'prompt': result['fixed_prompt'],
+                        'is_auto_fixed': not result['needs_manual'],
+                    }
+                    if result['fixed_refs'] is not None:
+                        entry['character_refs'] = result['fixed_refs']
+                    fixed.append(entry)
+
+        lines = [
+            '# 提示词验证报告',
+            '',
+            f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            '',
+            '## 汇总统计',
+        ]
+        lines.extend(f'- {key}: {value}' for key, value in summary.items())
+        lines.append('')
+        lines.append('## 发现的问题')
+        lines.extend(issue_lines or ['', '无'])
+        lines.append('')
+        lines.append('## 警告')
+        lines.extend(warning_lines or ['无'])
+        lines.append('')
+
+        with open(os.path.join(out_dir, 'validation_report.md'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        _write_json_rows(os.path.join(out_dir, 'fixed_prompts.json'), fixed)
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='提示词批量验证')
+    parser.add_argument('run_dir')
+    parser.add_argument('--refs-dir', default='references', help='角色/场景参考图目录')
+    parser.add_argument('--workers', type=int, help='进程池大小（默认CPU核数）')
+    args = parser.parse_args(argv)
+
+    tracer = RunTracer(args.run_dir)
+    with tracer.stage('validation'):
+        summary = PromptValidator(args.refs_dir, args.workers).validate_run(args.run_dir, tracer)
+    tracer.save()
+    print(f"✅ 验证完成：{summary['总镜头数']}个镜头，通过{summary['验证通过']}，"
+          f"可自动修复{summary['可自动修复']}，需人工处理{summary['需要人工处理']}"
+          f"（本次实际检查{summary['本次验证']}个）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
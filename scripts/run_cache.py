@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fullflow运行产物的增量缓存
+
+每个产物都用内容哈希和上游输入的哈希生成缓存键：
+    剧本   Episode-XX.md          ← 章节原文哈希 + 风格参数
+    提示词 Episode-XX-Prompts.json ← 剧本内容哈希
+    图像   Episode-XX-shot_NNN.png ← 镜头提示词哈希 + 引擎 + 风格
+
+缓存目录结构：
+    <cache_dir>/manifest.json          缓存键 → 产物哈希、大小、最后使用时间
+    <cache_dir>/objects/ab/abcdef...   按内容哈希存放的产物（只读）
+
+新运行开始前执行 restore，把上游未变化的产物恢复到运行目录（图像用硬链接，
+文本文件复制一份，方便后续步骤原地修改），只有变化的部分需要重新生成；
+每个步骤完成后执行 store 把新产物写入缓存。缓存超过大小上限时按LRU淘汰。
+
+用法：
+    python scripts/run_cache.py restore outputs/run_xxx
+    python scripts/run_cache.py store outputs/run_xxx
+    python scripts/run_cache.py stats
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+DEFAULT_CACHE_DIR = os.path.join('outputs', '.cache')
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_NOVEL_DIR = os.path.join(REPO_DIR, 'novel')
+
+SCRIPT_DIR = '01_scripts'
+PROMPTS_DIR = '02_image_prompts'
+IMAGES_DIR = '03_generated_images'
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """计算文件内容的sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_hash(text):
+    """计算字符串的sha256"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def cache_key(kind, *inputs):
+    """由产物类型和上游输入生成缓存键"""
+    digest = hashlib.sha256(kind.encode('utf-8'))
+    for item in inputs:
+        digest.update(b'\0')
+        digest.update(str(item).encode('utf-8'))
+    return f'{kind}:{digest.hexdigest()}'
+
+
+def atomic_write_json(path, data, indent=2):
+    """先写临时文件再替换，保证读到的JSON始终完整
+
+    只给程序读的大文件传 indent=None，可以走json的C编码器，快一个数量级。
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False, indent=indent))
+        # mkstemp创建的文件只有属主可读，改成和普通文件一致
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RunCache:
+    """按内容寻址的产物缓存，带磁盘清单和LRU淘汰"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.entries = {}
+        self.objects = {}
+        self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.entries = manifest.get('entries', {})
+        self.objects = manifest.get('objects', {})
+
+    def save(self):
+        """把清单写回磁盘"""
+        atomic_write_json(self.manifest_path, {
+            'version': 1,
+            'entries': self.entries,
+            'objects': self.objects,
+        })
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    @property
+    def total_bytes(self):
+        return sum(obj['size'] for obj in self.objects.values())
+
+    def lookup(self, key):
+        """返回缓存键对应的产物路径，不存在时返回None"""
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        path = self.object_path(entry['object'])
+        if not os.path.exists(path):
+            # 对象被手动删除，清理失效的缓存键
+            self.entries.pop(key)
+            self.objects.pop(entry['object'], None)
+            return None
+        entry['last_used'] = time.time()
+        return path
+
+    def store(self, key, src_path, kind=None):
+        """把文件写入缓存并记录缓存键，返回产物哈希"""
+        digest = file_hash(src_path)
+        path = self.object_path(digest)
+        if digest not in self.objects or not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.tmp{os.getpid()}'
+            shutil.copyfile(src_path, tmp_path)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+            self.objects[digest] = {'size': os.path.getsize(path)}
+        self.entries[key] = {
+            'object': digest,
+            'kind': kind or key.split(':', 1)[0],
+            'last_used': time.time(),
+        }
+        return digest
+
+    def materialize(self, key, dest_path, link=True):
+        """把缓存产物放到dest_path，link=True时优先用硬链接"""
+        src = self.lookup(key)
+        if src is None:
+            return False
+        if os.path.exists(dest_path) and os.path.samefile(src, dest_path):
+            return True
+        os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+        tmp_path = f'{dest_path}.tmp{os.getpid()}'
+        if link:
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                # 跨文件系统等情况无法硬链接，退回复制
+                shutil.copyfile(src, tmp_path)
+        else:
+            shutil.copyfile(src, tmp_path)
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, dest_path)
+        return True
+
+    def evict(self, max_bytes=None):
+        """按最后使用时间淘汰缓存，直到总大小不超过上限，返回释放的字节数"""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        total = self.total_bytes
+        if total <= limit:
+            return 0
+
+        refs = {}
+        for key, entry in self.entries.items():
+            refs.setdefault(entry['object'], []).append(key)
+
+        # 一个对象可能被多个缓存键引用，以其中最近的使用时间为准
+        order = sorted(
+            refs,
+            key=lambda digest: max(self.entries[k]['last_used'] for k in refs[digest]),
+        )
+        freed = 0
+        for digest in order:
+            if total <= limit:
+                break
+            for key in refs[digest]:
+                del self.entries[key]
+            size = self.objects.pop(digest, {}).get('size', 0)
+            path = self.object_path(digest)
+            if os.path.exists(path):
+                os.remove(path)
+            total -= size
+            freed += size
+        return freed
+
+
+def resolve_chapter_files(run_dir, novel_dir=DEFAULT_NOVEL_DIR):
+    """根据00_info.json找到本次运行对应的章节文件，第i个元素对应第i集
+
+    novel_chapters 中的相对路径相对仓库根目录，找不到时依次尝试 novel_dir 下的
+    同名文件、按文件名中的章节号查语料索引；只有章节范围时按章节号查索引。
+    与当前工作目录无关。任何一章找不到都抛出 FileNotFoundError：跳过一章会让
+    后面各集错用相邻章节的缓存键。
+    """
+    # novel_corpus 依赖本模块的 atomic_write_json，在这里导入避免循环引用
+    from novel_corpus import CHAPTER_RANGE_RE, NovelCorpus, parse_chapter_filename
+
+    info_path = os.path.join(run_dir, '00_info.json')
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        info = {}
+
+    corpus = None
+
+    def by_number(number):
+        nonlocal corpus
+        if corpus is None:
+            corpus = NovelCorpus(novel_dir) if os.path.isdir(novel_dir) else False
+        return corpus.path(number) if corpus and number in corpus.chapters else None
+
+    chapters = info.get('input', {}).get('novel_chapters')
+    if chapters:
+        labels = chapters
+        resolved = []
+        for path in chapters:
+            name = os.path.basename(path)
+            candidates = (os.path.join(REPO_DIR, path), os.path.join(novel_dir, name))
+            found = next((c for c in candidates if os.path.isfile(c)), None)
+            if not found:
+                parsed = parse_chapter_filename(name)
+                found = by_number(parsed[0]) if parsed else None
+            resolved.append(found)
+    else:
+        chapter_range = (info.get('parameters', {}).get('chapter_range')
+                         or info.get('run_info', {}).get('chapters', ''))
+        if not chapter_range:
+            return []
+        match = CHAPTER_RANGE_RE.match(chapter_range)
+        if not match:
+            raise ValueError(f'无法解析章节范围: {chapter_range}')
+        numbers = range(int(match.group(1)), int(match.group(2) or match.group(1)) + 1)
+        labels = [f'第{number}章' for number in numbers]
+        resolved = [by_number(number) for number in numbers]
+
+    missing = [label for label, path in zip(labels, resolved) if not path]
+    if missing:
+        raise FileNotFoundError(f"找不到章节文件：{'、'.join(missing)}")
+    return resolved
+
+
+def _run_params(run_dir):
+    with open(os.path.join(run_dir, '00_info.json'), 'r', encoding='utf-8') as f:
+        params = json.load(f).get('parameters', {})
+    return params.get('style', ''), params.get('engine', '')
+
+
+def iter_run_artifacts(run_dir, chapter_files):
+    """按依赖顺序生成运行目录中的产物 (缓存键, 相对路径, 类型)
+
+    只有上游产物已经存在时才能算出下游的缓存键，所以每次调用只会
+    列出当前可以确定的部分。
+    """
+    # image_scheduler 依赖本模块的 atomic_write_json，在这里导入避免循环引用
+    from image_scheduler import shot_filename
+    style, engine = _run_params(run_dir)
+    for index, chapter in enumerate(chapter_files, start=1):
+        script_rel = os.path.join(SCRIPT_DIR, f'Episode-{index:02d}.md')
+        yield cache_key('script', file_hash(chapter), style), script_rel, 'script'
+
+        script_path = os.path.join(run_dir, script_rel)
+        if not os.path.exists(script_path):
+            continue
+        prompts_rel = os.path.join(PROMPTS_DIR, f'Episode-{index:02d}-Prompts.json')
+        yield cache_key('prompts', file_hash(script_path), style), prompts_rel, 'prompts'
+
+        prompts_path = os.path.join(run_dir, prompts_rel)
+        try:
+            with open(prompts_path, 'r', encoding='utf-8') as f:
+                shots = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for shot in shots:
+            shot_number = shot.get('shot_number')
+            if not shot_number:
+                continue
+            image_rel = os.path.join(IMAGES_DIR, f'Episode-{index:02d}', shot_filename(index, shot_number))
+            key = cache_key('image', text_hash(shot.get('prompt', '')),
+                            json.dumps(shot.get('character_refs', []), ensure_ascii=False),
+                            engine, style)
+            yield key, image_rel, 'image'
+
+
+def restore_run(run_dir, cache, chapter_files):
+    """把缓存中已有的产物恢复到运行目录，返回 (恢复数, 需要生成的相对路径列表)
+
+    只补齐运行目录中缺失的产物，已存在的文件一律保留：上游键相同不代表内容
+    相同（例如手工修改过的提示词），下游的缓存键也按本地文件计算。
+    """
+    restored = 0
+    missing = []
+    # 恢复剧本后才能算出提示词的缓存键，所以逐个产物按依赖顺序处理
+    for key, rel_path, kind in iter_run_artifacts(run_dir, chapter_files):
+        dest = os.path.join(run_dir, rel_path)
+        if os.path.exists(dest):
+            continue
+        if cache.materialize(key, dest, link=(kind == 'image')):
+            restored += 1
+        else:
+            missing.append(rel_path)
+    cache.save()
+    return restored, missing
+
+
+def store_run(run_dir, cache, chapter_files):
+    """把运行目录中已生成的产物写入缓存，返回写入数"""
+    stored = 0
+    for key, rel_path, kind in iter_run_artifacts(run_dir, chapter_files):
+        path = os.path.join(run_dir, rel_path)
+        if os.path.exists(path):
+            cache.store(key, path, kind)
+            stored += 1
+    cache.evict()
+    cache.save()
+    return stored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='fullflow运行产物增量缓存')
+    parser.add_argument('action', choices=['restore', 'store', 'stats', 'evict'])
+    parser.add_argument('run_dir', nargs='?')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument('--novel-dir', default=DEFAULT_NOVEL_DIR)
+    args = parser.parse_args(argv)
+
+    cache = RunCache(args.cache_dir, args.max_bytes)
+
+    if args.action == 'stats':
+        print(f"📦 缓存条目：{len(cache.entries)}，对象：{len(cache.objects)}，"
+              f"占用：{cache.total_bytes / 1024 ** 2:.1f} MB / {args.max_bytes / 1024 ** 2:.0f} MB")
+        return 0
+    if args.action == 'evict':
+        freed = cache.evict()
+        cache.save()
+        print(f"🧹 已释放 {freed / 1024 ** 2:.1f} MB")
+        return 0
+
+    if not args.run_dir:
+        parser.error('restore/store 需要指定运行目录')
+    try:
+        chapter_files = resolve_chapter_files(args.run_dir, args.novel_dir)
+    except (OSError, ValueError) as exc:
+        print(f"❌ {exc}")
+        return 1
+    if not chapter_files:
+        print(f"❌ 无法确定 {args.run_dir} 对应的章节文件")
+        return 1
+
+    if args.action == 'restore':
+        restored, missing = restore_run(args.run_dir, cache, chapter_files)
+        print(f"✅ 从缓存恢复 {restored} 个产物，{len(missing)} 个需要重新生成")
+        for rel_path in missing:
+            print(f"  - {rel_path}")
+    else:
+        stored = store_run(args.run_dir, cache, chapter_files)
+        print(f"✅ 已缓存 {stored} 个产物")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
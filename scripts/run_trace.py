@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fullflow运行的阶段耗时与资源追踪
+
+每个阶段（剧本、提示词、验证、图像、视频、Excel导出）及其下的每集/每个镜头
+都记录为一个区间(span)：
+    wall_s         墙钟时间
+    cpu_s          进程CPU时间（含已结束的子进程）
+    peak_rss_mb    截至区间结束时的峰值内存（本进程与子进程取大）
+    read_bytes     实际读磁盘字节数（Linux /proc/self/io，不可用时为0）
+    write_bytes    实际写磁盘字节数
+    retries        重试次数（由调用方累加）
+同一进程内并发的区间（如异步生成的镜头）的CPU和I/O是进程级的增量，
+只有墙钟时间和重试次数是严格属于该镜头的。
+
+结果写入运行目录：
+    trace.json          全部区间，重新运行某个阶段时替换该阶段的旧记录
+    trace.chrome.json   Chrome Trace格式，可在 chrome://tracing 或 Perfetto 中打开
+并把每个阶段的汇总写入 00_info.json 的 performance 字段。
+
+用法：
+    # 其它脚本内部：tracer = RunTracer(run_dir); with tracer.span('images', 'stage'): ...
+    # 包装外部命令作为一个阶段
+    python scripts/run_trace.py run outputs/run_xxx video -- python make_video.py ...
+    python scripts/run_trace.py summary outputs/run_xxx
+    python scripts/run_trace.py compare outputs/run_a outputs/run_b
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from run_cache import atomic_write_json
+
+TRACE_FILE = 'trace.json'
+CHROME_TRACE_FILE = 'trace.chrome.json'
+TRACE_VERSION = 1
+
+# 当前所在的区间，asyncio任务和to_thread线程会继承创建时的上下文
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _new_id():
+    """区间id：trace.json合并多次运行、多个进程的记录，用随机id保证不重复"""
+    return uuid.uuid4().hex[:16]
+
+
+def _io_counters():
+    """返回本进程 (读字节, 写字节)，非Linux平台返回 (0, 0)"""
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            fields = dict(line.split(b':', 1) for line in f.read().splitlines())
+        return int(fields[b'read_bytes']), int(fields[b'write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _maxrss_mb(usage):
+    # Linux上ru_maxrss单位是KB，macOS上是字节
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _resources():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, write_bytes = _io_counters()
+    return {
+        'cpu': own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        'rss': max(_maxrss_mb(own), _maxrss_mb(children)),
+        # 子进程的I/O只能按块统计（512字节/块）
+        'read': read_bytes + children.ru_inblock * 512,
+        'write': write_bytes + children.ru_oublock * 512,
+    }
+
+
+class Span:
+    """一个计时区间，retries、error和args可以在区间内随时设置"""
+
+    def __init__(self, tracer, name, cat, parent, args):
+        self.tracer = tracer
+        self.id = _new_id()
+        self.name = name
+        self.cat = cat
+        self.parent = parent.id if parent else None
+        self.stage = parent.stage if parent else name
+        self.args = dict(args)
+        self.retries = 0
+        self.error = None
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._r0 = _resources()
+
+    def add_retry(self, count=1):
+        self.retries += count
+
+    def finish(self, error=None):
+        end = _resources()
+        record = {
+            'id': self.id,
+            'parent': self.parent,
+            'stage': self.stage,
+            'name': self.name,
+            'cat': self.cat,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'start': round(self.start, 6),
+            'wall_s': round(time.perf_counter() - self._t0, 6),
+            'cpu_s': round(end['cpu'] - self._r0['cpu'], 6),
+            'peak_rss_mb': round(end['rss'], 1),
+            'read_bytes': end['read'] - self._r0['read'],
+            'write_bytes': end['write'] - self._r0['write'],
+            'retries': self.retries,
+        }
+        if self.args:
+            record['args'] = self.args
+        error = error or self.error
+        if error:
+            record['error'] = error
+        self.tracer._record(record)
+        return record
+
+
+class RunTracer:
+    """收集一次脚本运行中的所有区间，save() 时合并进运行目录的trace.json
+
+    run_dir为None时只在内存中记录，不写文件。
+    """
+
+    def __init__(self, run_dir=None):
+        self.run_dir = run_dir
+        self.records = []
+        self._lock = threading.Lock()
+
+    def _record(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    @contextmanager
+    def span(self, name, cat='unit', **args):
+        """记录一个区间；嵌套调用时自动挂到外层区间下"""
+        span = Span(self, name, cat, _current_span.get(), args)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.finish(error=f'{type(exc).__name__}: {exc}')
+            raise
+        else:
+            span.finish()
+        finally:
+            _current_span.reset(token)
+
+    def stage(self, name, **args):
+        return self.span(name, 'stage', **args)
+
+    def start(self, name, cat='unit', **args):
+        """开始一个不能用with包住的区间（如由事件流结束的任务），需自行调用finish()"""
+        return Span(self, name, cat, _current_span.get(), args)
+
+    def adopt(self, records):
+        """收编在进程池worker里记录的区间，挂到当前区间下
+
+        记录换上新id（同时改写记录之间的父子引用），同一批记录被收编多次
+        也不会出现重复id。
+        """
+        parent = _current_span.get()
+        ids = {record['id']: _new_id() for record in records}
+        for record in records:
+            record = dict(record, id=ids[record['id']])
+            if record['parent'] is not None:
+                record['parent'] = ids.get(record['parent'], record['parent'])
+            elif parent:
+                record['parent'] = parent.id
+            if parent:
+                record['stage'] = parent.stage
+            self._record(record)
+
+    def save(self):
+        """合并写出trace.json、trace.chrome.json，并更新00_info.json"""
+        if not self.run_dir or not self.records:
+            return None
+        records = load_trace(self.run_dir)
+        # 重新运行的阶段替换旧记录，其它阶段保留
+        stages = {record['stage'] for record in self.records}
+        records = [record for record in records if record['stage'] not in stages] + self.records
+        records.sort(key=lambda record: record['start'])
+
+        atomic_write_json(os.path.join(self.run_dir, TRACE_FILE), {
+            'version': TRACE_VERSION,
+            'spans': records,
+        }, indent=None)
+        atomic_write_json(os.path.join(self.run_dir, CHROME_TRACE_FILE),
+                          to_chrome_trace(records), indent=None)
+        summary = summarize(records)
+        update_info(self.run_dir, summary)
+        return summary
+
+
+def load_trace(run_dir):
+    try:
+        with open(os.path.join(run_dir, TRACE_FILE), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if data.get('version') != TRACE_VERSION:
+        return []
+    return data.get('spans', [])
+
+
+def summarize(records):
+    """按阶段汇总：阶段区间本身的资源数据 + 下属单元的数量和重试次数"""
+    stages = {}
+    for record in records:
+        if record['cat'] != 'stage':
+            continue
+        stages[record['stage']] = {
+            'start': record['start'],
+            'wall_s': round(record['wall_s'], 3),
+            'cpu_s': round(record['cpu_s'], 3),
+            'peak_rss_mb': record['peak_rss_mb'],
+            'read_mb': round(record['read_bytes'] / 1024 ** 2, 2),
+            'write_mb': round(record['write_bytes'] / 1024 ** 2, 2),
+            'units': 0,
+            'retries': record['retries'],
+            'errors': 1 if record.get('error') else 0,
+        }
+    for record in records:
+        stage = stages.get(record['stage'])
+        if stage is None or record['cat'] == 'stage':
+            continue
+        stage['units'] += 1
+        stage['retries'] += record['retries']
+        stage['errors'] += 1 if record.get('error') else 0
+
+    ordered = sorted(stages.items(), key=lambda item: item[1]['start'])
+    for _, stage in ordered:
+        del stage['start']
+    return {
+        'total_wall_s': round(sum(stage['wall_s'] for _, stage in ordered), 3),
+        'stages': dict(ordered),
+    }
+
+
+def update_info(run_dir, summary):
+    """把阶段汇总写入00_info.json的performance字段"""
+    info_path = os.path.join(run_dir, '00_info.json')
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return False
+    info['performance'] = dict(summary, trace=TRACE_FILE, chrome_trace=CHROME_TRACE_FILE)
+    atomic_write_json(info_path, info)
+    return True
+
+
+def to_chrome_trace(records):
+    """转换为Chrome Trace事件格式
+
+    同一线程上并发的异步区间不满足严格嵌套，Chrome会画乱，所以按时间贪心分配到
+    若干"车道"(tid)上：每条车道是一个栈，只有能完全嵌套在栈顶区间内的才放进去。
+    """
+    events = []
+    lanes = {}
+    for record in sorted(records, key=lambda r: (r['start'], -r['wall_s'])):
+        start = record['start']
+        end = start + record['wall_s']
+        pid_lanes = lanes.setdefault(record['pid'], [])
+        for lane, stack in enumerate(pid_lanes):
+            while stack and stack[-1] <= start:
+                stack.pop()
+            if not stack or stack[-1] >= end:
+                stack.append(end)
+                break
+        else:
+            lane = len(pid_lanes)
+            pid_lanes.append([end])
+
+        args = {key: record[key] for key in (
+            'cpu_s', 'peak_rss_mb', 'read_bytes', 'write_bytes', 'retries',
+        )}
+        args.update(record.get('args', {}))
+        if record.get('error'):
+            args['error'] = record['error']
+        events.append({
+            'name': record['name'],
+            'cat': record['cat'],
+            'ph': 'X',
+            'ts': int(start * 1e6),
+            'dur': max(1, int(record['wall_s'] * 1e6)),
+            'pid': record['pid'],
+            'tid': lane,
+            'args': args,
+        })
+        if record['cat'] == 'stage':
+            events.append({
+                'name': 'process_name', 'ph': 'M', 'pid': record['pid'],
+                'args': {'name': record['stage']},
+            })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def run_command(run_dir, stage, command):
+    """把一个外部命令作为阶段运行并记录，返回命令的退出码"""
+    tracer = RunTracer(run_dir)
+    with tracer.stage(stage, command=' '.join(command)) as span:
+        returncode = subprocess.call(command)
+        if returncode:
+            span.args['returncode'] = returncode
+    tracer.save()
+    return returncode
+
+
+def _print_summary(run_dir, summary):
+    print(f"📊 {os.path.basename(os.path.normpath(run_dir))}  总耗时 {summary['total_wall_s']:.1f}s")
+    for name, stage in summary['stages'].items():
+        print(f"  {name:<12} {stage['wall_s']:>9.2f}s  CPU {stage['cpu_s']:>8.2f}s  "
+              f"内存峰值 {stage['peak_rss_mb']:>7.1f}MB  读 {stage['read_mb']:>7.2f}MB  "
+              f"写 {stage['write_mb']:>7.2f}MB  单元 {stage['units']:>5}  重试 {stage['retries']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='fullflow运行的阶段耗时与资源追踪')
+    sub = parser.add_subparsers(dest='action', required=True)
+    run = sub.add_parser('run', help='把外部命令作为一个阶段运行并记录')
+    run.add_argument('run_dir')
+    run.add_argument('stage')
+    run.add_argument('command', nargs=argparse.REMAINDER)
+    show = sub.add_parser('summary', help='显示运行目录的阶段汇总')
+    show.add_argument('run_dir')
+    compare = sub.add_parser('compare', help='对比两次运行各阶段的耗时')
+    compare.add_argument('base_run')
+    compare.add_argument('new_run')
+    compare.add_argument('--tolerance', type=float, default=0.2, help='耗时增加超过该比例视为退化')
+    args = parser.parse_args(argv)
+
+    if args.action == 'run':
+        command = args.command[1:] if args.command[:1] == ['--'] else args.command
+        if not command:
+            parser.error('缺少要运行的命令')
+        return run_command(args.run_dir, args.stage, command)
+
+    if args.action == 'summary':
+        records = load_trace(args.run_dir)
+        if not records:
+            print(f'⚠️ 没有找到追踪记录: {os.path.join(args.run_dir, TRACE_FILE)}')
+            return 1
+        _print_summary(args.run_dir, summarize(records))
+        return 0
+
+    base = summarize(load_trace(args.base_run))['stages']
+    new = summarize(load_trace(args.new_run))['stages']
+    regressions = 0
+    for name in list(base) + [name for name in new if name not in base]:
+        if name not in base or name not in new:
+            print(f"  {name:<12} {'只在新运行中' if name in new else '只在基准运行中'}")
+            continue
+        before, after = base[name]['wall_s'], new[name]['wall_s']
+        change = (after - before) / before if before else 0.0
+        regressed = change > args.tolerance
+        regressions += regressed
+        print(f"{'❌' if regressed else '✅'} {name:<12} {before:>9.2f}s → {after:>9.2f}s  ({change:+.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+本地假ComfyUI服务器，供 comfyui_engine 的测试使用
+
+实现引擎用到的接口：POST /prompt、POST /upload/image、GET /history/<id>、
+GET /view、GET /ws（websocket，只发文本帧）。每个提交的prompt在后台线程里
+依次推送 execution_start → progress → executed → executing(node=None)。
+按输出文件名前缀可以模拟两种异常情况：
+    errors   推送 execution_error，没有输出
+    cached   不推送 executed（ComfyUI输出命中缓存时的行为），结果只能从history取
+"""
+
+import base64
+import hashlib
+import json
+import queue
+import struct
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from image_scheduler import _png_bytes
+
+WS_MAGIC = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def _ws_frame(text):
+    data = text.encode('utf-8')
+    if len(data) < 126:
+        header = bytes([0x81, len(data)])
+    elif len(data) < 65536:
+        header = bytes([0x81, 126]) + struct.pack('>H', len(data))
+    else:
+        header = bytes([0x81, 127]) + struct.pack('>Q', len(data))
+    return header + data
+
+
+class FakeComfyUI:
+    """在随机端口上运行的假ComfyUI，记录收到的请求"""
+
+    def __init__(self, errors=(), cached=()):
+        self.errors = set(errors)
+        self.cached = set(cached)
+        self.prompts = []
+        self.uploads = 0
+        # 发起HTTP请求的客户端地址（websocket连接不计入），用来检查连接复用
+        self.http_clients = set()
+        self.history = {}
+        self._sockets = {}
+        self._jobs = queue.Queue()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def host(self):
+        return f'127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._worker, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._jobs.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _send(self, client_id, kind, data):
+        writer = self._sockets[client_id]
+        writer.write(_ws_frame(json.dumps({'type': kind, 'data': data})))
+        writer.flush()
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            prompt_id, client_id, graph = job
+            save_id = next(node_id for node_id, node in graph.items() if node['class_type'] == 'SaveImage')
+            prefix = graph[save_id]['inputs']['filename_prefix']
+            image = {'filename': prefix.replace('/', '_') + '_00001_.png', 'subfolder': '', 'type': 'output'}
+
+            self._send(client_id, 'execution_start', {'prompt_id': prompt_id})
+            if any(prefix.endswith(name) for name in self.errors):
+                self._send(client_id, 'execution_error', {
+                    'prompt_id': prompt_id, 'node_id': save_id, 'exception_message': 'fake failure',
+                })
+                self.history[prompt_id] = {'outputs': {}}
+                continue
+            for value in (1, 2):
+                self._send(client_id, 'progress', {'prompt_id': prompt_id, 'value': value, 'max': 2})
+            self.history[prompt_id] = {'outputs': {save_id: {'images': [image]}}}
+            if not any(prefix.endswith(name) for name in self.cached):
+                self._send(client_id, 'executed', {
+                    'prompt_id': prompt_id, 'node': save_id, 'output': {'images': [image]},
+                })
+            self._send(client_id, 'executing', {'prompt_id': prompt_id, 'node': None})
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body, content_type='application/json'):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _upgrade(self):
+                client_id = self.path.split('clientId=', 1)[1]
+                accept = base64.b64encode(hashlib.sha1(
+                    (self.headers['Sec-WebSocket-Key'] + WS_MAGIC).encode()).digest()).decode()
+                self.wfile.write((
+                    'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                    f'Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n'
+                ).encode())
+                fake._sockets[client_id] = self.wfile
+                fake._send(client_id, 'status', {'status': {'exec_info': {'queue_remaining': 0}}})
+                # 读取客户端帧直到收到关闭帧，回一个关闭帧（否则客户端要等待超时）
+                try:
+                    while True:
+                        header = self.rfile.read(2)
+                        if len(header) < 2:
+                            break
+                        length = header[1] & 0x7f
+                        if length == 126:
+                            length = struct.unpack('>H', self.rfile.read(2))[0]
+                        elif length == 127:
+                            length = struct.unpack('>Q', self.rfile.read(8))[0]
+                        self.rfile.read(length + (4 if header[1] & 0x80 else 0))
+                        if header[0] & 0x0f == 0x8:
+                            self.wfile.write(b'\x88\x00')
+                            self.wfile.flush()
+                            break
+                except OSError:
+                    pass
+                fake._sockets.pop(client_id, None)
+                self.close_connection = True
+
+            def do_GET(self):
+                if self.path.startswith('/ws'):
+                    self._upgrade()
+                    return
+                fake.http_clients.add(self.client_address)
+                if self.path.startswith('/view'):
+                    self._reply(_png_bytes(32, 18, self.path), 'image/png')
+                elif self.path.startswith('/history/'):
+                    prompt_id = self.path.rsplit('/', 1)[1]
+                    self._reply(json.dumps({prompt_id: fake.history.get(prompt_id, {})}).encode())
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                fake.http_clients.add(self.client_address)
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.path == '/prompt':
+                    payload = json.loads(body)
+                    prompt_id = uuid.uuid4().hex
+                    fake.prompts.append(payload['prompt'])
+                    fake._jobs.put((prompt_id, payload['client_id'], payload['prompt']))
+                    self._reply(json.dumps({
+                        'prompt_id': prompt_id, 'number': len(fake.prompts), 'node_errors': {},
+                    }).encode())
+                elif self.path == '/upload/image':
+                    fake.uploads += 1
+                    self._reply(json.dumps({
+                        'name': f'upload_{fake.uploads}.png', 'subfolder': '', 'type': 'input',
+                    }).encode())
+                else:
+                    self.send_error(404)
+
+        return Handler
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""comfyui_engine.run_jobs 对假ComfyUI服务器的端到端测试"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+sys.path.insert(0, TESTS_DIR)
+
+import comfyui_engine  # noqa: E402
+from fake_comfyui import FakeComfyUI  # noqa: E402
+
+WORKFLOW = os.path.join(REPO_DIR, 'comfyui-workflows', 'image_z_image_turbo.json')
+EDIT_WORKFLOW = os.path.join(REPO_DIR, 'comfyui-workflows', 'qwen-edit.json')
+
+
+class TimeoutClient(comfyui_engine.ComfyUIClient):
+    """测试用：websocket接收设超时，出错时测试失败而不是挂住"""
+
+    def connect(self):
+        super().connect()
+        self._ws.settimeout(10)
+
+
+def make_run(run_dir, shots=4, refs=()):
+    os.makedirs(os.path.join(run_dir, '02_image_prompts'))
+    with open(os.path.join(run_dir, '02_image_prompts', 'Episode-01-Prompts.json'), 'w',
+              encoding='utf-8') as f:
+        json.dump([
+            {'shot_number': f'shot_{index:03d}', 'prompt': f'镜头{index}，仙侠动漫风格',
+             'characters': [], 'character_refs': list(refs)}
+            for index in range(1, shots + 1)
+        ], f, ensure_ascii=False)
+
+
+class RunJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp(prefix='comfyui-test-')
+        make_run(self.run_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def run_engine(self, fake, **options):
+        fake.start()
+        self.addCleanup(fake.stop)
+        jobs = comfyui_engine.build_jobs(self.run_dir, WORKFLOW, **options)
+        client = TimeoutClient(fake.host)
+        try:
+            result = comfyui_engine.run_jobs(client, jobs, self.run_dir, on_progress=None)
+        finally:
+            client.close()
+        with open(os.path.join(self.run_dir, '03_generated_images', 'Episode-01',
+                               'generation_status.json'), 'r', encoding='utf-8') as f:
+            status = {img['shot_number']: img for img in json.load(f)['images']}
+        return result, status
+
+    def image_path(self, shot_number):
+        return os.path.join(self.run_dir, '03_generated_images', 'Episode-01',
+                            f'Episode-01-{shot_number}.png')
+
+    def test_all_shots_generated_over_one_connection(self):
+        fake = FakeComfyUI()
+        (ok, failed), status = self.run_engine(fake)
+        self.assertEqual((ok, failed), (4, 0))
+        self.assertEqual(len(fake.prompts), 4)
+        # 提交、下载全部复用一个keep-alive连接
+        self.assertEqual(len(fake.http_clients), 1)
+        for shot_number, entry in status.items():
+            self.assertEqual(entry['status'], 'generated')
+            self.assertTrue(os.path.exists(self.image_path(shot_number)))
+
+    def test_prompt_text_and_seed_filled_in(self):
+        fake = FakeComfyUI()
+        self.run_engine(fake)
+        graph = fake.prompts[0]
+        texts = [node['inputs'].get('text') for node in graph.values()
+                 if node['class_type'] == 'CLIPTextEncode']
+        self.assertIn('镜头1，仙侠动漫风格', texts)
+        seeds = [node['inputs']['seed'] for node in graph.values() if node['class_type'] == 'KSampler']
+        self.assertEqual(seeds, [comfyui_engine.shot_seed(1, 'shot_001')])
+
+    def test_execution_error_marks_shot_failed(self):
+        fake = FakeComfyUI(errors={'Episode-01-shot_002'})
+        (ok, failed), status = self.run_engine(fake)
+        self.assertEqual((ok, failed), (3, 1))
+        self.assertEqual(status['shot_002']['status'], 'failed')
+        self.assertEqual(status['shot_002']['error'], 'fake failure')
+        self.assertFalse(os.path.exists(self.image_path('shot_002')))
+
+    def test_cached_output_fetched_from_history(self):
+        fake = FakeComfyUI(cached={'Episode-01-shot_003'})
+        (ok, failed), status = self.run_engine(fake)
+        self.assertEqual((ok, failed), (4, 0))
+        self.assertEqual(status['shot_003']['status'], 'generated')
+        self.assertTrue(os.path.exists(self.image_path('shot_003')))
+
+    def test_reference_images_uploaded_once(self):
+        shutil.rmtree(self.run_dir)
+        make_run(self.run_dir, refs=['林渊.png'])
+        refs_dir = os.path.join(self.run_dir, 'refs')
+        os.makedirs(refs_dir)
+        with open(os.path.join(refs_dir, '林渊.png'), 'wb') as f:
+            f.write(b'fake reference image')
+        fake = FakeComfyUI()
+        (ok, failed), _ = self.run_engine(fake, edit_workflow=EDIT_WORKFLOW, refs_dir=refs_dir)
+        self.assertEqual((ok, failed), (4, 0))
+        # 四个镜头共用一张参考图，只上传一次
+        self.assertEqual(fake.uploads, 1)
+        loaded = {node['inputs']['image'] for graph in fake.prompts for node in graph.values()
+                  if node['class_type'] == 'LoadImage'}
+        self.assertEqual(loaded, {'upload_1.png'})
+        # 采样器的latent来自设置了16:9分辨率的空latent，而不是参考图的VAEEncode
+        for graph in fake.prompts:
+            sampler = next(node for node in graph.values() if node['class_type'] == 'KSampler')
+            latent = graph[sampler['inputs']['latent_image'][0]]
+            self.assertEqual(latent['class_type'], 'EmptySD3LatentImage')
+            self.assertEqual((latent['inputs']['width'], latent['inputs']['height']),
+                             (comfyui_engine.DEFAULT_WIDTH, comfyui_engine.DEFAULT_HEIGHT))
+
+    def test_existing_images_are_skipped(self):
+        fake = FakeComfyUI()
+        self.run_engine(fake)
+        jobs = comfyui_engine.build_jobs(self.run_dir, WORKFLOW)
+        self.assertEqual(jobs, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""image_scheduler.generate_run 使用桩后端的断点续跑测试"""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'scripts'))
+
+import image_scheduler  # noqa: E402
+
+
+class FlakyBackend(image_scheduler.StubBackend):
+    """指定镜头固定失败或超时，其余镜头正常返回"""
+
+    def __init__(self, failing=(), hanging=()):
+        super().__init__(latency=0)
+        self.failing = set(failing)
+        self.hanging = set(hanging)
+        self.requested = []
+
+    async def generate(self, shot):
+        self.requested.append(shot['shot_number'])
+        if shot['shot_number'] in self.hanging:
+            await asyncio.sleep(10)
+        if shot['shot_number'] in self.failing:
+            raise RuntimeError('simulated failure')
+        return await super().generate(shot)
+
+
+def make_run(run_dir, episodes=(1, 2), shots=5):
+    os.makedirs(os.path.join(run_dir, '02_image_prompts'))
+    for episode in episodes:
+        path = os.path.join(run_dir, '02_image_prompts', f'Episode-{episode:02d}-Prompts.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([
+                {'shot_number': f'shot_{index:03d}', 'prompt': f'第{episode}集镜头{index}'}
+                for index in range(1, shots + 1)
+            ], f, ensure_ascii=False)
+
+
+class GenerateRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp(prefix='scheduler-test-')
+        make_run(self.run_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def generate(self, backend, **options):
+        options = dict({'concurrency': 3, 'rate': 0, 'retries': 1, 'backoff': 0, 'timeout': 5}, **options)
+        return asyncio.run(image_scheduler.generate_run(self.run_dir, backend, **options))
+
+    def status(self, episode):
+        path = os.path.join(self.run_dir, '03_generated_images', f'Episode-{episode:02d}',
+                            image_scheduler.STATUS_FILE)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def image_path(self, episode, shot_number):
+        return os.path.join(self.run_dir, '03_generated_images', f'Episode-{episode:02d}',
+                            image_scheduler.shot_filename(episode, shot_number))
+
+    def test_failed_shots_retried_then_resumed(self):
+        backend = FlakyBackend(failing={'shot_002'})
+        results = self.generate(backend)
+        self.assertEqual(results, {1: (4, 1), 2: (4, 1)})
+        # retries=1：每集的失败镜头共请求两次
+        self.assertEqual(backend.requested.count('shot_002'), 4)
+        status = self.status(1)
+        failed = [img for img in status['images'] if img['status'] == 'failed']
+        self.assertEqual([img['shot_number'] for img in failed], ['shot_002'])
+        self.assertEqual(failed[0]['attempts'], 2)
+        self.assertEqual(status['generated'], 4)
+        self.assertFalse(os.path.exists(self.image_path(1, 'shot_002')))
+
+        # 重新运行只提交上次失败的镜头
+        backend = FlakyBackend()
+        results = self.generate(backend)
+        self.assertEqual(results, {1: (1, 0), 2: (1, 0)})
+        self.assertEqual(backend.requested, ['shot_002', 'shot_002'])
+        self.assertEqual(self.status(1)['status'], 'completed')
+
+    def test_missing_file_is_regenerated(self):
+        self.generate(FlakyBackend())
+        os.remove(self.image_path(2, 'shot_004'))
+        backend = FlakyBackend()
+        results = self.generate(backend)
+        # 状态文件声称已生成，但以磁盘为准重新生成
+        self.assertEqual(results, {1: (0, 0), 2: (1, 0)})
+        self.assertEqual(backend.requested, ['shot_004'])
+        self.assertTrue(os.path.exists(self.image_path(2, 'shot_004')))
+
+    def test_timeout_counts_as_failure(self):
+        backend = FlakyBackend(hanging={'shot_005'})
+        results = self.generate(backend, episodes=[1], timeout=0.05, retries=0)
+        self.assertEqual(results, {1: (4, 1)})
+        entry = {img['shot_number']: img for img in self.status(1)['images']}['shot_005']
+        self.assertEqual(entry['status'], 'failed')
+        self.assertIn('TimeoutError', entry['error'])
+
+    def test_partial_status_file_not_left_behind(self):
+        self.generate(FlakyBackend())
+        image_dir = os.path.join(self.run_dir, '03_generated_images', 'Episode-01')
+        leftovers = [name for name in os.listdir(image_dir) if name.endswith('.part') or '.tmp' in name]
+        self.assertEqual(leftovers, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""prompt_validator 扫描与单镜头检查的测试"""
+
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'scripts'))
+
+from prompt_validator import QUALITY_CONSTRAINTS, STYLE_ANCHORS, _scan, check_shot  # noqa: E402
+
+TAIL = '，'.join(STYLE_ANCHORS[:3] + QUALITY_CONSTRAINTS) + '。'
+
+
+def shot(prompt, characters=(), refs=()):
+    return {'shot_number': 'shot_001', 'prompt': prompt, 'characters': list(characters),
+            'character_refs': list(refs), 'has_character': False}
+
+
+class ScanTest(unittest.TestCase):
+
+    def test_combined_bind_tag(self):
+        hits, = _scan([f'【图一参考林渊，图二参考青袍修士】矿洞中对峙，{TAIL}'])
+        self.assertEqual(hits['bind'], {'林渊', '青袍修士'})
+        self.assertEqual(len(hits['style']), 3)
+
+    def test_unclosed_tag_does_not_swallow_next_shot(self):
+        hits = _scan([f'【图一参考林渊 矿洞中，{TAIL}', f'【图一参考哪吒】陈塘关，{TAIL}'])
+        self.assertEqual(hits[0]['bind'], set())
+        self.assertEqual(hits[1]['bind'], {'哪吒'})
+
+
+class CheckShotTest(unittest.TestCase):
+
+    def check(self, item, refs=frozenset(), aliases=None):
+        hits, = _scan([item['prompt']])
+        return check_shot(item, hits, refs, aliases)
+
+    def test_valid_shot(self):
+        result = self.check(shot(f'【图一参考林渊】矿洞中，{TAIL}', ['林渊'], ['林渊.png']),
+                            refs={'林渊.png'})
+        self.assertTrue(result['is_valid'])
+        self.assertIsNone(result['fixed_prompt'])
+
+    def test_unbound_characters_numbered_by_reference_position(self):
+        item = shot(f'两人对峙，{TAIL}', ['林渊', '哪吒'], ['哪吒.png', '林渊.png'])
+        result = self.check(item, refs={'林渊.png', '哪吒.png'})
+        self.assertEqual(result['issues'], ['角色未绑定参考图标记: 林渊', '角色未绑定参考图标记: 哪吒'])
+        self.assertTrue(result['fixed_prompt'].startswith('【图二参考林渊，图一参考哪吒】'))
+
+    def test_alias_reference_counts_for_numbering(self):
+        item = shot(f'两人对峙，{TAIL}', ['哪吒', '林渊'], ['linxuan.png', '哪吒.png'])
+        result = self.check(item, refs={'林渊.png', '哪吒.png'}, aliases={'linxuan.png': '林渊.png'})
+        self.assertTrue(result['fixed_prompt'].startswith('【图二参考哪吒，图一参考林渊】'))
+        self.assertEqual(result['fixed_refs'], ['林渊.png', '哪吒.png'])
+
+    def test_without_references_falls_back_to_character_order(self):
+        result = self.check(shot(f'两人对峙，{TAIL}', ['林渊', '哪吒']))
+        self.assertTrue(result['fixed_prompt'].startswith('【图一参考林渊，图二参考哪吒】'))
+
+    def test_only_unbound_character_is_added(self):
+        item = shot(f'【图一参考林渊】两人对峙，{TAIL}', ['林渊', '哪吒'], ['林渊.png', '哪吒.png'])
+        result = self.check(item, refs={'林渊.png', '哪吒.png'})
+        self.assertEqual(result['issues'], ['角色未绑定参考图标记: 哪吒'])
+        self.assertTrue(result['fixed_prompt'].startswith('【图二参考哪吒】【图一参考林渊】'))
+
+    def test_fixed_prompt_passes_validation(self):
+        item = shot('两人对峙', ['林渊', '哪吒'], ['林渊.png', '哪吒.png'])
+        refs = {'林渊.png', '哪吒.png'}
+        result = self.check(item, refs=refs)
+        self.assertFalse(result['is_valid'])
+        again = self.check(dict(item, prompt=result['fixed_prompt']), refs=refs)
+        self.assertTrue(again['is_valid'], again['issues'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""run_cache 的章节解析、store/restore 测试"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+
+import run_cache  # noqa: E402
+from image_scheduler import _png_bytes, shot_filename  # noqa: E402
+
+SAMPLE_RUN = os.path.join(REPO_DIR, 'outputs', 'run_20251223_233308_anime')
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def make_novel(novel_dir, chapters=3):
+    os.makedirs(novel_dir)
+    paths = []
+    for number in range(1, chapters + 1):
+        path = os.path.join(novel_dir, f'第{number}章-合成章节{number}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'第{number}章的正文。\n')
+        paths.append(path)
+    return paths
+
+
+def write_info(run_dir, chapter_files):
+    write_json(os.path.join(run_dir, '00_info.json'), {
+        'parameters': {'style': '国风动漫', 'engine': 'seedream'},
+        'input': {'novel_chapters': chapter_files},
+    })
+
+
+def make_run(run_dir, chapter_files, shots=3):
+    write_info(run_dir, chapter_files)
+    for episode in range(1, len(chapter_files) + 1):
+        os.makedirs(os.path.join(run_dir, '01_scripts'), exist_ok=True)
+        with open(os.path.join(run_dir, '01_scripts', f'Episode-{episode:02d}.md'), 'w',
+                  encoding='utf-8') as f:
+            f.write(f'# 第{episode}集\n')
+        shot_list = [{'shot_number': f'shot_{index:03d}', 'prompt': f'第{episode}集镜头{index}'}
+                     for index in range(1, shots + 1)]
+        write_json(os.path.join(run_dir, '02_image_prompts', f'Episode-{episode:02d}-Prompts.json'),
+                   shot_list)
+        image_dir = os.path.join(run_dir, '03_generated_images', f'Episode-{episode:02d}')
+        os.makedirs(image_dir, exist_ok=True)
+        for shot in shot_list:
+            with open(os.path.join(image_dir, shot_filename(episode, shot['shot_number'])), 'wb') as f:
+                f.write(_png_bytes(8, 8, f"{episode}-{shot['shot_number']}"))
+
+
+class ResolveChapterFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='run-cache-test-')
+        self.novel_dir = os.path.join(self.root, 'novel')
+        self.chapters = make_novel(self.novel_dir)
+        self.run_dir = os.path.join(self.root, 'run')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_missing_chapter_is_an_error(self):
+        os.remove(self.chapters[1])
+        write_info(self.run_dir, self.chapters)
+        # 不能跳过第2章：否则第3章会被当作Episode-02的输入
+        with self.assertRaises(FileNotFoundError) as ctx:
+            run_cache.resolve_chapter_files(self.run_dir, self.novel_dir)
+        self.assertIn('第2章', str(ctx.exception))
+
+    def test_moved_chapter_found_by_number(self):
+        moved = [os.path.join(self.root, 'old', os.path.basename(path)) for path in self.chapters]
+        os.rename(self.chapters[1], os.path.join(self.novel_dir, '第2章：改过的标题.txt'))
+        write_info(self.run_dir, moved)
+        resolved = run_cache.resolve_chapter_files(self.run_dir, self.novel_dir)
+        self.assertEqual([os.path.basename(path) for path in resolved],
+                         ['第1章-合成章节1.txt', '第2章：改过的标题.txt', '第3章-合成章节3.txt'])
+
+    def test_chapter_range_with_gap_is_an_error(self):
+        os.remove(self.chapters[1])
+        write_json(os.path.join(self.run_dir, '00_info.json'), {'parameters': {'chapter_range': '1-3'}})
+        with self.assertRaises(FileNotFoundError):
+            run_cache.resolve_chapter_files(self.run_dir, self.novel_dir)
+
+    def test_relative_paths_independent_of_cwd(self):
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+        resolved = run_cache.resolve_chapter_files(SAMPLE_RUN)
+        self.assertEqual(len(resolved), 3)
+        self.assertTrue(all(os.path.isfile(path) for path in resolved))
+
+
+class StoreRestoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='run-cache-test-')
+        self.chapters = make_novel(os.path.join(self.root, 'novel'), chapters=2)
+        self.cache = run_cache.RunCache(os.path.join(self.root, 'cache'))
+        self.source = os.path.join(self.root, 'run_a')
+        make_run(self.source, self.chapters)
+        run_cache.store_run(self.source, self.cache, self.chapters)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_restore_into_fresh_run(self):
+        run_dir = os.path.join(self.root, 'run_b')
+        write_info(run_dir, self.chapters)
+        restored, missing = run_cache.restore_run(run_dir, self.cache, self.chapters)
+        # 2集 × (剧本 + 提示词 + 3张图)
+        self.assertEqual((restored, missing), (10, []))
+        rel = os.path.join('03_generated_images', 'Episode-02', shot_filename(2, 'shot_003'))
+        with open(os.path.join(self.source, rel), 'rb') as a, open(os.path.join(run_dir, rel), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_edited_shot_is_the_only_missing_image(self):
+        run_dir = os.path.join(self.root, 'run_b')
+        write_info(run_dir, self.chapters)
+        run_cache.restore_run(run_dir, self.cache, self.chapters)
+
+        prompts_path = os.path.join(run_dir, '02_image_prompts', 'Episode-01-Prompts.json')
+        with open(prompts_path, 'r', encoding='utf-8') as f:
+            shots = json.load(f)
+        shots[1]['prompt'] = '手工修改过的提示词'
+        write_json(prompts_path, shots)
+        shutil.rmtree(os.path.join(run_dir, '03_generated_images'))
+
+        restored, missing = run_cache.restore_run(run_dir, self.cache, self.chapters)
+        self.assertEqual(missing, [os.path.join('03_generated_images', 'Episode-01',
+                                                shot_filename(1, 'shot_002'))])
+        self.assertEqual(restored, 5)
+        # 手工修改的提示词保留，不被缓存里的旧版本覆盖
+        with open(prompts_path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)[1]['prompt'], '手工修改过的提示词')
+
+
+if __name__ == '__main__':
+    unittest.main()